@@ -0,0 +1,331 @@
+"""
+Benchmark suite for the stages of the partsbox api interface, run on synthetic data (see synthetic_data).
+
+Each stage is timed and its peak memory is recorded, results can be saved as a baseline
+and later runs are compared against it so regressions show up as numbers.
+
+usage: python benchmark.py --parts 1000 20000 [--entries 60] [--engine calculate|columnar] [--save-baseline]
+       python benchmark.py --parts 200000 --scaling 1 2 4 8 16 (scaling curve of parallel.get_analytics)
+       python benchmark.py --import-budget (time and module count of import main, in a fresh interpreter)
+
+"""
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import calculate
+import columnar
+import parallel
+import ranking
+import sort_data
+import synthetic_data
+import time_stamp
+
+
+BASELINE = "benchmark_baseline.json"
+THRESHOLD = 1.2 #a stage is reported as a regression when it is this many times slower than the baseline
+ENGINES = {"calculate": calculate, "columnar": columnar}
+REPEAT = 3 #number of times each stage is run, the fastest run is kept
+TOP_N = 20 #number of most urgent parts found by the get_top_n stage
+IMPORT_SECONDS = 0.25 #budget for import main, heavy dependencies are only imported by the stages that use them
+IMPORT_MODULES = 300 #budget for the number of modules loaded by import main
+#run in a fresh interpreter so modules already imported by the benchmark are not counted as free
+IMPORT_SCRIPT = ("import sys, time, json; start = time.perf_counter(); import main; "
+				 "print(json.dumps({'seconds': time.perf_counter() - start, 'modules': len(sys.modules), "
+				 "'heavy': sorted(name for name in ('pandas', 'numpy', 'requests', 'alive_progress', 'ratelimit', 'multiprocessing') if name in sys.modules)}))")
+
+
+def run_stage(results, name, function, *args):
+	"""
+	Run a single stage, recording its time and peak memory.
+
+	@params
+		- results: dictionary of stage names to results, the result of this stage is added to it
+		- name: name of the stage
+		- function: function for the stage
+		- args: arguments passed to function
+	@returns
+		- output: return value of function
+	"""
+	gc.collect()
+	tracemalloc.reset_peak()
+	before = tracemalloc.get_traced_memory()[0]
+
+	start = time.perf_counter()
+	output = function(*args)
+	seconds = time.perf_counter() - start
+
+	peak = tracemalloc.get_traced_memory()[1] - before
+	results[name] = {"seconds": seconds, "peak_bytes": max(0, peak)}
+
+	return output
+
+
+def run_benchmark(number_of_parts, entries_per_part = synthetic_data.ENTRIES_PER_PART, engine = "calculate", seed = synthetic_data.SEED, repeat = REPEAT):
+	"""
+	Run every stage on a synthetic inventory.
+
+	Memory is traced for the whole run, tracing slows every stage by about the same factor
+	so runs are only comparable with other runs of this suite. The stages are run repeat times
+	and the fastest time of each stage is kept, which keeps noise from showing up as a regression.
+
+	@params
+		- number_of_parts: number of parts in the synthetic inventory
+		- entries_per_part: average number of stock entries per part
+		- engine: "calculate" or "columnar", module used for the batch average, time average and risk level stages
+		- seed: seed for synthetic_data
+		- repeat: number of times the stages are run
+	@returns
+		- result: dictionary with the size of the inventory and the time (seconds) and peak memory (bytes) of each stage
+	"""
+	analytics = ENGINES[engine]
+	Timestamps = time_stamp.get_timestamps()
+	payloads = synthetic_data.get_payloads(number_of_parts, entries_per_part, seed = seed, current_timestamp = Timestamps[0])
+	parts = payloads["part/all"]["data"]
+	#lead times are set in memory as update_lead_times would, sort expects every part to have one
+	for part in sort_data.get_missing_leads(parts):
+		sort_data.set_lead(part, sort_data.DEFAULT_LEAD_TIME)
+	projects = payloads["project/all"]["data"]
+	project_boms = [{"project_name": project["project/name"],
+					 "parts": [entry["entry/part-id"] for entry in payloads["project/get-entries"][project["project/id"]]["data"]]}
+					for project in projects]
+
+	stages = {}
+	tracemalloc.start()
+	try:
+		for run in range(repeat):
+			results = {}
+			#original stages, kept to compare with the single pass scan
+			run_stage(results, "total_stock", calculate.total_stock, parts)
+			run_stage(results, "sort", sort_data.sort, parts, Timestamps)
+
+			sorted_stock = run_stage(results, "scan_stock", sort_data.scan_stock, parts)
+			run_stage(results, "get_avg_batch", analytics.get_avg_batch, sorted_stock, Timestamps)
+			run_stage(results, "get_avg_time", analytics.get_avg_time, sorted_stock, Timestamps)
+			run_stage(results, "get_time_since_last_batch", time_stamp.get_time_since_last_batch, Timestamps[0], sorted_stock)
+			run_stage(results, "get_risk_level", analytics.get_risk_level, sorted_stock, Timestamps[0])
+			run_stage(results, "build_ranked_index", ranking.build_index, sorted_stock)
+			run_stage(results, "get_top_n", ranking.get_top_n, sorted_stock, "estimated_rop", TOP_N)
+			run_stage(results, "update_project_data", sort_data.update_project_data, project_boms, sorted_stock)
+			run_stage(results, "get_data_for_airtable", sort_data.get_data_for_airtable, sorted_stock)
+			run_stage(results, "airtable_batches", lambda sorted_stock: sum(1 for batch in sort_data.get_groups_of_ten(sort_data.iter_airtable_records(sorted_stock))), sorted_stock)
+
+			for name in results:
+				if name not in stages or results[name]["seconds"] < stages[name]["seconds"]:
+					stages[name] = results[name]
+	finally:
+		tracemalloc.stop()
+
+	result = {"parts": number_of_parts,
+			  "stock_entries": sum(len(part["part/stock"]) for part in parts),
+			  "engine": engine,
+			  "stages": stages}
+
+	return result
+
+
+def get_baseline_key(result):
+	"""
+	Get the key a result is stored under in the baseline file.
+
+	@params
+		- result: dictionary returned by run_benchmark
+	@returns
+		- key: string made from the engine and the number of parts and stock entries
+	"""
+	return f"{result['engine']}/{result['parts']}/{result['stock_entries']}"
+
+
+def load_baseline(baseline_name = BASELINE):
+	"""
+	Load stored baseline results.
+
+	@params
+		- baseline_name: name of the baseline file
+	@returns
+		- baseline: dictionary of baseline keys (see get_baseline_key) to results, empty if there is no baseline yet
+	"""
+	try:
+		with open(baseline_name) as file:
+			return json.load(file)
+	except (FileNotFoundError, json.JSONDecodeError):
+		return {}
+
+
+def save_baseline(results, baseline_name = BASELINE):
+	"""
+	Store results as the baseline, results for other sizes already in the file are kept.
+
+	@params
+		- results: list of dictionaries returned by run_benchmark
+		- baseline_name: name of the baseline file
+	@returns
+		- none
+	"""
+	baseline = load_baseline(baseline_name)
+	for result in results:
+		baseline[get_baseline_key(result)] = result
+
+	#write to a temporary file first so an interrupted write never leaves a truncated baseline
+	temporary_name = baseline_name + ".tmp"
+	with open(temporary_name, "w") as file:
+		json.dump(baseline, file, indent = 4)
+	os.replace(temporary_name, baseline_name)
+
+
+def compare_to_baseline(result, baseline, threshold = THRESHOLD):
+	"""
+	Compare the stages of a result with the baseline for the same inventory.
+
+	@params
+		- result: dictionary returned by run_benchmark
+		- baseline: dictionary returned by load_baseline
+		- threshold: time ratio above which a stage is reported as a regression
+	@returns
+		- comparison: dictionary of stage names to time and memory ratios (result / baseline) and a regression flag,
+		              empty if the baseline has no result for this inventory
+	"""
+	baseline_result = baseline.get(get_baseline_key(result))
+	comparison = {}
+	if baseline_result is None:
+		return comparison
+
+	for name, stage in result["stages"].items():
+		baseline_stage = baseline_result["stages"].get(name)
+		if baseline_stage is None:
+			continue
+
+		time_ratio = stage["seconds"] / max(baseline_stage["seconds"], 1e-9)
+		memory_ratio = stage["peak_bytes"] / max(baseline_stage["peak_bytes"], 1)
+		comparison[name] = {"time_ratio": time_ratio, "memory_ratio": memory_ratio, "regression": time_ratio > threshold}
+
+	return comparison
+
+
+def run_scaling(number_of_parts, worker_counts, entries_per_part = synthetic_data.ENTRIES_PER_PART, engine = "calculate", seed = synthetic_data.SEED):
+	"""
+	Time parallel.get_analytics with different numbers of worker processes on the same inventory.
+
+	@params
+		- number_of_parts: number of parts in the synthetic inventory
+		- worker_counts: list of numbers of workers to time
+		- entries_per_part: average number of stock entries per part
+		- engine: name of the module used for the averages and risk level (see parallel.ENGINES)
+		- seed: seed for synthetic_data
+	@returns
+		- scaling: list of dictionaries with the number of workers, time (seconds) and speedup over the first worker count
+	"""
+	Timestamps = time_stamp.get_timestamps()
+	parts = synthetic_data.get_parts(number_of_parts, entries_per_part, seed = seed, current_timestamp = Timestamps[0])
+	sorted_stock = sort_data.scan_stock(parts, compact = True)
+
+	scaling = []
+	for workers in worker_counts:
+		start = time.perf_counter()
+		parallel.get_analytics(sorted_stock, Timestamps, workers = workers, engine = engine)
+		seconds = time.perf_counter() - start
+
+		speedup = scaling[0]["seconds"] / seconds if scaling else 1.0
+		scaling.append({"workers": workers, "seconds": seconds, "speedup": speedup})
+		print(f"{workers:>3} workers {seconds:>10.3f}s {speedup:>6.2f}x")
+
+	return scaling
+
+
+def check_import_budget(seconds = IMPORT_SECONDS, modules = IMPORT_MODULES, repeat = REPEAT):
+	"""
+	Time import main in a fresh interpreter and check it against the import budget.
+
+	@params
+		- seconds: budget for the import time
+		- modules: budget for the number of modules in sys.modules after the import
+		- repeat: number of interpreters started, the fastest import is kept
+	@returns
+		- result: dictionary with the import time, number of modules, heavy dependencies that were loaded
+		          and ok (bool, True if both budgets were met)
+	"""
+	directory = os.path.dirname(os.path.abspath(__file__))
+	runs = []
+	for run in range(repeat):
+		output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd = directory, capture_output = True, text = True, check = True)
+		runs.append(json.loads(output.stdout.splitlines()[-1]))
+
+	result = min(runs, key = lambda run: run["seconds"])
+	result["ok"] = result["seconds"] <= seconds and result["modules"] <= modules
+
+	return result
+
+
+def print_result(result, comparison):
+	"""
+	Print a table of stage times and peak memory, with ratios to the baseline if there is one.
+
+	@params
+		- result: dictionary returned by run_benchmark
+		- comparison: dictionary returned by compare_to_baseline
+	@returns
+		- none
+	"""
+	print(f"\n{result['parts']} parts, {result['stock_entries']} stock entries ({result['engine']})")
+	print(f"{'stage':<28}{'seconds':>10}{'peak MB':>10}{'time x':>9}{'memory x':>10}")
+
+	for name, stage in result["stages"].items():
+		line = f"{name:<28}{stage['seconds']:>10.3f}{stage['peak_bytes'] / 1e6:>10.1f}"
+		if name in comparison:
+			line = line + f"{comparison[name]['time_ratio']:>9.2f}{comparison[name]['memory_ratio']:>10.2f}"
+			if comparison[name]["regression"]:
+				line = line + "  REGRESSION"
+		print(line)
+
+
+"""main"""
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "benchmark each stage on synthetic PartsBox data")
+	parser.add_argument("--parts", type = int, nargs = "+", default = [synthetic_data.SIZES["small"]], help = "number of parts, one run per size")
+	parser.add_argument("--entries", type = int, default = synthetic_data.ENTRIES_PER_PART, help = "average number of stock entries per part")
+	parser.add_argument("--engine", choices = ENGINES, default = "calculate")
+	parser.add_argument("--seed", type = int, default = synthetic_data.SEED)
+	parser.add_argument("--repeat", type = int, default = REPEAT, help = "number of runs, the fastest time of each stage is kept")
+	parser.add_argument("--baseline", default = BASELINE, help = "baseline file to compare with")
+	parser.add_argument("--threshold", type = float, default = THRESHOLD)
+	parser.add_argument("--save-baseline", action = "store_true", help = "store the results as the new baseline")
+	parser.add_argument("--scaling", type = int, nargs = "+", help = "numbers of worker processes to time parallel analytics with, instead of the stage benchmark")
+	parser.add_argument("--import-budget", action = "store_true", help = "check the time and number of modules of import main against the budget, instead of the stage benchmark")
+	args = parser.parse_args()
+
+	if args.import_budget:
+		result = check_import_budget(repeat = args.repeat)
+		print(f"import main: {result['seconds']:.3f}s (budget {IMPORT_SECONDS}s), {result['modules']} modules (budget {IMPORT_MODULES})")
+		if result["heavy"]:
+			print(f"heavy dependencies loaded at import: {', '.join(result['heavy'])}")
+		raise SystemExit(0 if result["ok"] else 1)
+
+	if args.scaling:
+		for number_of_parts in args.parts:
+			print(f"\n{number_of_parts} parts, parallel analytics ({args.engine})")
+			run_scaling(number_of_parts, args.scaling, args.entries, args.engine, args.seed)
+		raise SystemExit(0)
+
+	baseline = load_baseline(args.baseline)
+	results = []
+	regressions = 0
+
+	for number_of_parts in args.parts:
+		result = run_benchmark(number_of_parts, args.entries, args.engine, args.seed, args.repeat)
+		comparison = compare_to_baseline(result, baseline, args.threshold)
+		print_result(result, comparison)
+		regressions += sum(stage["regression"] for stage in comparison.values())
+		results.append(result)
+
+	if args.save_baseline:
+		save_baseline(results, args.baseline)
+		print(f"\nbaseline saved to {args.baseline}")
+
+	if regressions:
+		print(f"\n{regressions} stages slower than {args.threshold}x the baseline")
+		raise SystemExit(1)
@@ -1,80 +1,641 @@
 '''
-module that contains functions for creating an updating the json cache file
+module that contains functions for creating an updating the response cache and local json files
+
+api responses are cached in a single SQLite database, keyed by url and request parameters,
+every write is a transaction so an interrupted run never leaves a truncated cache
 
 '''
 
+import codecs
 import json 
-import requests 
+import mmap
+import hashlib
+import sqlite3
+import struct
+import tempfile
+import threading
 import time 
 import os
+from array import array
+from contextlib import closing
+import model
+import partsbox
+
+
+CACHE_DATABASE = "request_cache.sqlite3"
+MILLI_PER_WEEK = 604800000
+MILLI_PER_MONTH = 2629746000
+#time to live for each timeframe, in milliseconds 
+TTLS = {"week": MILLI_PER_WEEK, "month": MILLI_PER_MONTH}
+
+#hit and miss counters for the current process, keyed by database so accounts run at once each count their own 
+CACHE_STATS = {}
+CACHE_STATS_LOCK = threading.Lock()
+
+STREAM_CHUNK_SIZE = 65536 #(bytes)
+#fields kept when streaming parts, everything else is dropped while parsing 
+PART_FIELDS = ("part/id", "part/description", "part/mpn", "part/custom-fields", "part/stock")
+STOCK_FIELDS = ("stock/timestamp", "stock/quantity", "stock/comments")
+
+SNAPSHOT_NAME = "stock_snapshot.bin"
+SNAPSHOT_MAGIC = b"PBSNAP01"
+SNAPSHOT_HEADER = struct.Struct("<8sqqqq") #magic, fetched, number of parts, number of stock entries, number of strings
+
+
+def get_connection(database = CACHE_DATABASE):
+	"""
+	Open the cache database, creating the responses and aggregates tables if they do not exist.
+
+	@params
+		- database: file name of the SQLite database
+	@returns
+		- connection: sqlite3 connection, to be closed by the caller
+	"""
+	connection = sqlite3.connect(database, timeout = 30)
+	connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+							  key TEXT PRIMARY KEY,
+							  resource TEXT NOT NULL,
+							  fetched INTEGER NOT NULL,
+							  body TEXT NOT NULL)""")
+	connection.execute("CREATE INDEX IF NOT EXISTS responses_resource ON responses (resource, fetched)")
+	#computed averages of each part, see incremental
+	connection.execute("""CREATE TABLE IF NOT EXISTS aggregates (
+							  part_id TEXT PRIMARY KEY,
+							  fingerprint TEXT NOT NULL,
+							  windows TEXT NOT NULL,
+							  body TEXT NOT NULL)""")
+
+	return connection
 
 
-def fetch_data(*, update: bool = False, json_cache: str, url: str, headers: dict, params: dict):
+def get_cache_key(url, params):
 	"""
-	Determine if cache file exists.
+	Get the key a response is stored under.
 
-		if file exists - use data from file
-		else - creates cache file, makes api request, stores response in file 
+	@params
+		- url: url for api request
+		- params: parameters for api request or None
+	@returns
+		- key: url and parameters (sorted so equal parameters give the same key)
+	"""
+	if params is None:
+		return url
+
+	return url + "?" + json.dumps(params, sort_keys = True, separators = (",", ":"))
+
+
+def get_fetched(url, params, database = CACHE_DATABASE):
+	"""
+	Get the time a cached response was fetched from the api.
+
+	@params
+		- url: url for api request
+		- params: parameters for api request or None
+		- database: file name of the SQLite database the response is cached in
+	@returns
+		- fetched: time in milliseconds, None if the response is not cached
+	"""
+	with closing(get_connection(database)) as connection:
+		row = connection.execute("SELECT fetched FROM responses WHERE key = ?", (get_cache_key(url, params),)).fetchone()
+
+	return None if row is None else row[0]
+
+
+def fetch_data(*, update: bool = False, json_cache: str, url: str, headers: dict, params: dict, ttl: int = None, client = None, database: str = CACHE_DATABASE):
+	"""
+	Determine if a cached response exists.
+
+		if a fresh response is cached - use data from the cache 
+		else - makes api request, stores response in the cache 
 
 	@params
 		- update: bool flag (set to true if update to cache is required, false otherwise)
-		- json_cache: file name
+		- json_cache: name of the cached resource (e.g. request_cache.json), responses are grouped by resource 
 		- url: url for api request
 		- headers: for api request, including authorization/api key
+		- params: parameters for api request or None
+		- ttl: optional time to live in milliseconds, cached responses older than this are fetched again 
+		- client: optional PartsBoxClient, defaults to the shared client (see partsbox.get_client)
+		- database: file name of the SQLite database the response is cached in
 	@returns
-		- json_data: data in the cache file or data from api request 
+		- json_data: data in the cache or data from api request 
 	"""	
-	if update:
-		json_data = None
-	else:
-		try:
-			#cache is created 
-			with open(json_cache, 'r') as file:
-				json_data = json.load(file)
+	key = get_cache_key(url, params)
+	json_data = None
+
+	with closing(get_connection(database)) as connection:
+		if not update:
+			row = connection.execute("SELECT fetched, body FROM responses WHERE key = ?", (key,)).fetchone()
+
+			if row is None:
+				print("No local cache found...")
+			elif ttl is not None and row[0] < int(time.time() * 1000) - ttl:
+				print("Local cache has expired...")
+			else:
+				json_data = json.loads(row[1])
 				print("Fetched data from local cache!")
-		except(FileNotFoundError, json.JSONDecodeError) as e:
-			print(f"No local cache found... ({e})")
-			json_data = None
-
-	#create cache file 
-	if not json_data:
-		print("Fetching new json data... (creating local cache)")
-		if params != None:
-			json_data = requests.get(url, headers = headers, params = params).json()
-		else:
-			json_data = requests.get(url, headers = headers).json()
 
-		with open(json_cache, "w") as file:
-			json.dump(json_data, file)
+		if not json_data:
+			count_cache(database, "misses")
+			print("Fetching new json data... (updating local cache)")
+			client = client or partsbox.get_client()
+			response = client.get(url, headers = headers, params = params)
+			response.raise_for_status() #never cache an error response
+
+			body = response.text
+			json_data = json.loads(body)
+
+			#replace the cached response in a single transaction 
+			with connection:
+				connection.execute("INSERT OR REPLACE INTO responses (key, resource, fetched, body) VALUES (?, ?, ?, ?)",
+								   (key, json_cache, int(time.time() * 1000), body))
+		else:
+			count_cache(database, "hits")
 
 	return json_data
 
 
-def get_update_flag(current_timestamp, cache, timeframe): 
+class JsonStreamReader:
+	"""
+	Incremental reader for a json document in a binary file, used to parse large responses piece by piece.
+
+	Only the text that has not been parsed yet is buffered, values are decoded with json.JSONDecoder.raw_decode 
+	once enough of the file has been read to hold them.
+
+	@params
+		- file: binary file like object with a read method (http response body, open file, sqlite blob)
+		- chunk_size: number of bytes read at a time
+	"""
+
+	def __init__(self, file, chunk_size = STREAM_CHUNK_SIZE):
+		self.file = file
+		self.chunk_size = chunk_size
+		self.decoder = json.JSONDecoder()
+		self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+		self.buffer = ""
+		self.position = 0
+		self.eof = False
+
+	def read_more(self, size = None):
+		"""
+		Read more of the file into the buffer, dropping text that has already been parsed.
+
+		@params
+			- size: number of bytes to read, defaults to chunk_size
+		@returns
+			- none
+		"""
+		chunk = self.file.read(size or self.chunk_size)
+		if not chunk:
+			self.eof = True
+
+		self.buffer = self.buffer[self.position:] + self.text_decoder.decode(chunk, final = self.eof)
+		self.position = 0
+
+	def peek(self):
+		"""
+		Skip whitespace and get the next character without consuming it.
+
+		@params
+			- none
+		@returns
+			- character: next character, empty string at the end of the file
+		"""
+		while True:
+			while self.position < len(self.buffer) and self.buffer[self.position] in " \t\n\r":
+				self.position += 1
+
+			if self.position < len(self.buffer) or self.eof:
+				return self.buffer[self.position:self.position + 1]
+
+			self.read_more()
+
+	def expect(self, characters):
+		"""
+		Consume the next character, which must be one of characters.
+
+		@params
+			- characters: string of allowed characters
+		@returns
+			- character: the character consumed
+		"""
+		character = self.peek()
+		if not character or character not in characters:
+			raise json.JSONDecodeError(f"Expecting one of {characters!r}", self.buffer, self.position)
+
+		self.position += 1
+
+		return character
+
+	def decode_value(self):
+		"""
+		Decode the next json value.
+
+		@params
+			- none
+		@returns
+			- value: decoded json value
+		"""
+		self.peek()
+		size = self.chunk_size
+
+		while True:
+			try:
+				value, end = self.decoder.raw_decode(self.buffer, self.position)
+				#a value running to the end of the buffer may be cut off (e.g. a number), unless the file has ended
+				if end < len(self.buffer) or self.eof:
+					self.position = end
+					return value
+			except json.JSONDecodeError:
+				if self.eof:
+					raise
+
+			#read geometrically more so a large value is not parsed again for every chunk
+			self.read_more(size)
+			size = size * 2
+
+
+def iter_json_array(file, key = "data"):
+	"""
+	Yield the items of an array in a top level json object one at a time.
+
+	@params
+		- file: binary file like object containing a json object (e.g. an api response)
+		- key: key of the array in the top level object
+	@returns
+		- items: generator of decoded array items, other values in the object are parsed and discarded
+	"""
+	reader = JsonStreamReader(file)
+	reader.expect("{")
+
+	if reader.peek() == "}":
+		return
+
+	while True:
+		name = reader.decode_value()
+		reader.expect(":")
+
+		if name == key:
+			reader.expect("[")
+			if reader.peek() == "]":
+				reader.expect("]")
+			else:
+				while True:
+					yield reader.decode_value()
+					if reader.expect(",]") == "]":
+						break
+		else:
+			reader.decode_value()
+
+		if reader.expect(",}") == "}":
+			return
+
+
+def prune_part(part):
+	"""
+	Drop the fields of a part that are never used.
+
+	@params
+		- part: data for a single part from the api response
+	@returns
+		- pruned_part: part with only PART_FIELDS, and only STOCK_FIELDS in each stock entry
+	"""
+	pruned_part = {field: part[field] for field in PART_FIELDS if field in part}
+
+	if "part/stock" in pruned_part:
+		pruned_part["part/stock"] = [{field: stock[field] for field in STOCK_FIELDS if field in stock} 
+									 for stock in pruned_part["part/stock"]]
+
+	return pruned_part
+
+
+def stream_data(*, update: bool = False, json_cache: str, url: str, headers: dict, params: dict, ttl: int = None, snapshot_name: str = None, client = None, database: str = CACHE_DATABASE):
+	"""
+	Streaming version of fetch_data for responses with a large data list, such as part/all. 
+
+	Parts are parsed one at a time straight from the cache or the http body and unused fields are dropped, 
+	so only one part is held in memory at a time instead of the whole response. 
+	A new response is spooled to a temporary file and copied into the cache in chunks. 
+
+	@params
+		- update: bool flag (set to true if update to cache is required, false otherwise)
+		- json_cache: name of the cached resource (e.g. request_cache.json), responses are grouped by resource 
+		- url: url for api request
+		- headers: for api request, including authorization/api key
+		- params: parameters for api request or None
+		- ttl: optional time to live in milliseconds, cached responses older than this are fetched again 
+		- snapshot_name: optional file name, a binary snapshot (see Snapshot) of the parts is written there once every part has been read
+		- client: optional PartsBoxClient, defaults to the shared client (see partsbox.get_client)
+		- database: file name of the SQLite database the response is cached in
+	@returns
+		- parts: generator of pruned parts (see prune_part) from the data list of the response
+	"""
+	key = get_cache_key(url, params)
+
+	with closing(get_connection(database)) as connection:
+		rowid = None
+		if not update:
+			row = connection.execute("SELECT rowid, fetched FROM responses WHERE key = ?", (key,)).fetchone()
+
+			if row is None:
+				print("No local cache found...")
+			elif ttl is not None and row[1] < int(time.time() * 1000) - ttl:
+				print("Local cache has expired...")
+			else:
+				rowid = row[0]
+				fetched = row[1]
+				print("Streaming data from local cache!")
+
+		if rowid is None:
+			count_cache(database, "misses")
+			print("Fetching new json data... (updating local cache)")
+			client = client or partsbox.get_client()
+			with client.get(url, headers = headers, params = params, stream = True) as response, tempfile.TemporaryFile() as spool:
+				response.raise_for_status() #never cache an error response
+				for chunk in response.iter_content(STREAM_CHUNK_SIZE): #decompressed body
+					spool.write(chunk)
+
+				size = spool.tell()
+				spool.seek(0)
+
+				#replace the cached response in a single transaction 
+				fetched = int(time.time() * 1000)
+				with connection:
+					cursor = connection.execute("INSERT OR REPLACE INTO responses (key, resource, fetched, body) VALUES (?, ?, ?, zeroblob(?))",
+												(key, json_cache, fetched, size))
+					rowid = cursor.lastrowid
+					with connection.blobopen("responses", "body", rowid) as blob:
+						for chunk in iter(lambda: spool.read(STREAM_CHUNK_SIZE), b""):
+							blob.write(chunk)
+		else:
+			count_cache(database, "hits")
+
+		builder = None if snapshot_name is None else SnapshotBuilder(fetched, key)
+
+		with connection.blobopen("responses", "body", rowid, readonly = True) as blob:
+			for part in iter_json_array(blob):
+				part = prune_part(part)
+				if builder is not None:
+					builder.add(part)
+				yield part
+
+		if builder is not None:
+			builder.write(snapshot_name)
+
+
+class SnapshotBuilder:
+	"""
+	Collects normalized stock history for a binary snapshot (see Snapshot for the format).
+
+	Parts are added one at a time, only their columns and strings are kept.
+
+	@params
+		- fetched: time the response the parts come from was fetched, unix timestamp in milliseconds
+		- key: cache key of the response
+	"""
+
+	def __init__(self, fetched, key):
+		self.fetched = fetched
+		self.key = key
+		self.part_offsets = array("q", [0])
+		self.lead_times = array("q")
+		self.timestamps = array("q")
+		self.quantities = array("q")
+		self.flags = bytearray()
+		self.strings = []
+
+	def add(self, part):
+		"""
+		Add a part from the api response.
+
+		@params
+			- part: data for a single part (pruned or full)
+		@returns
+			- none
+		"""
+		import sort_data #imported here as sort_data imports cache
+
+		history = model.StockHistory.from_entries(part.get("part/stock") or [])
+		self.timestamps.extend(history.timestamps)
+		self.quantities.extend(history.quantities)
+		self.flags.extend(history.flags)
+		self.part_offsets.append(len(self.timestamps))
+		self.lead_times.append(int(sort_data.get_lead(part)))
+		self.strings.extend((part["part/id"], part.get("part/mpn"), part.get("part/description")))
+
+	def write(self, snapshot_name):
+		"""
+		Write the snapshot, the file is replaced atomically.
+
+		@params
+			- snapshot_name: file name of snapshot
+		@returns
+			- none
+		"""
+		strings = self.strings + [self.key]
+		string_offsets = array("q", [0])
+		string_nulls = bytearray()
+		encoded = []
+		for string in strings:
+			string_nulls.append(string is None)
+			encoded.append(b"" if string is None else string.encode("utf-8"))
+			string_offsets.append(string_offsets[-1] + len(encoded[-1]))
+
+		temp_name = snapshot_name + ".tmp"
+		with open(temp_name, "wb") as file:
+			file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.fetched, len(self.lead_times), len(self.timestamps), len(strings)))
+			for column in (self.part_offsets, string_offsets, self.timestamps, self.quantities, self.lead_times, string_nulls, self.flags):
+				data = column.tobytes() if isinstance(column, array) else bytes(column)
+				file.write(data)
+				file.write(bytes(-len(data) % 8)) #pad so every column starts on an 8 byte boundary
+			file.write(b"".join(encoded))
+
+		os.replace(temp_name, snapshot_name)
+
+
+class Snapshot:
 	"""
-	Determine if cache file needs to be updated with new data from partsbox.
+	Memory mapped binary snapshot of the normalized stock history of every part.
+
+	Opening a snapshot only reads the header, columns are memoryviews into the mapped file (no copies).
+
+	Format (little endian, every column padded to 8 bytes):
+		- header: magic, fetched time, number of parts (n), number of stock entries (m), number of strings (s)
+		- part_offsets: int64 * (n + 1), stock entries of part i are at [part_offsets[i], part_offsets[i + 1])
+		- string_offsets: int64 * (s + 1), into the string data
+		- timestamps: int64 * m, unix timestamps in milliseconds
+		- quantities: int64 * m
+		- lead_times: int64 * n, lead time in weeks from the custom field (0 if missing)
+		- string_nulls: uint8 * s, 1 where the string is None
+		- flags: uint8 * m, model.MOVED / model.BATCH
+		- string data: utf-8, part id, mpn and description for each part followed by the cache key
+
+	@params
+		- snapshot_name: file name of snapshot
+	"""
+
+	def __init__(self, snapshot_name):
+		with open(snapshot_name, "rb") as file:
+			self.map = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+		view = memoryview(self.map)
+		try:
+			magic, self.fetched, number_of_parts, number_of_entries, number_of_strings = SNAPSHOT_HEADER.unpack_from(view)
+		except struct.error:
+			view.release()
+			self.map.close()
+			raise
+		if magic != SNAPSHOT_MAGIC:
+			view.release()
+			self.map.close()
+			raise ValueError(f"{snapshot_name} is not a stock history snapshot")
+
+		layout = ((number_of_parts + 1, 8, "q"), (number_of_strings + 1, 8, "q"), (number_of_entries, 8, "q"), 
+				  (number_of_entries, 8, "q"), (number_of_parts, 8, "q"), (number_of_strings, 1, "B"), (number_of_entries, 1, "B"))
+
+		#a truncated file (e.g. an interrupted copy) is rejected before any column is cast
+		end = SNAPSHOT_HEADER.size + sum(length * size + (-(length * size) % 8) for length, size, kind in layout)
+		size = len(view)
+		if min(number_of_parts, number_of_entries, number_of_strings) < 0 or end > size:
+			view.release()
+			self.map.close()
+			raise ValueError(f"{snapshot_name} is truncated, expected at least {end} bytes, found {size}")
+
+		position = SNAPSHOT_HEADER.size
+		columns = []
+		for length, size, kind in layout:
+			columns.append(view[position:position + length * size].cast(kind))
+			position = position + length * size + (-(length * size) % 8)
+
+		self.part_offsets, self.string_offsets, self.timestamps, self.quantities, self.lead_times, self.string_nulls, self.flags = columns
+		self.strings = view[position:]
+		self.view = view
+
+		if number_of_strings < 1 or self.string_offsets[-1] > len(self.strings):
+			self.close()
+			raise ValueError(f"{snapshot_name} is truncated, the string data is incomplete")
+
+		self.key = self.get_string(number_of_strings - 1)
+
+	def __len__(self):
+		return len(self.lead_times)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+
+	def close(self):
+		"""
+		Release the columns and unmap the file.
+
+		@params
+			- none
+		@returns
+			- none
+		"""
+		for column in (self.part_offsets, self.string_offsets, self.timestamps, self.quantities, self.lead_times, self.string_nulls, self.flags, self.strings, self.view):
+			column.release()
+		self.map.close()
+
+	def get_string(self, index):
+		"""
+		Get a string from the string table.
+
+		@params
+			- index: index of the string, for part i: 3i is the id, 3i + 1 the mpn and 3i + 2 the description
+		@returns
+			- string: decoded string or None
+		"""
+		if self.string_nulls[index]:
+			return None
+
+		return bytes(self.strings[self.string_offsets[index]:self.string_offsets[index + 1]]).decode("utf-8")
+
+	def get_part(self, index):
+		"""
+		Get a part from the snapshot.
+
+		@params
+			- index: position of the part in the snapshot
+		@returns
+			- part: dictionary with part/id, part/mpn, part/description, lead_time_(weeks) and stock, 
+			        stock is a model.StockHistory of memoryviews into the snapshot (no copies)
+		"""
+		start = self.part_offsets[index]
+		end = self.part_offsets[index + 1]
+
+		part = {"part/id": self.get_string(3 * index), 
+				"part/mpn": self.get_string(3 * index + 1), 
+				"part/description": self.get_string(3 * index + 2), 
+				"lead_time_(weeks)": self.lead_times[index], 
+				"stock": model.StockHistory(self.timestamps[start:end], self.quantities[start:end], self.flags[start:end])}
+
+		return part
+
+
+def get_snapshot(*, update: bool = False, url: str, params: dict, ttl: int = None, snapshot_name: str = SNAPSHOT_NAME, database: str = CACHE_DATABASE):
+	"""
+	Open the snapshot of a cached response if it is still valid.
+
+	@params
+		- update: bool flag (set to true if update to cache is required, no snapshot is returned)
+		- url: url for api request
+		- params: parameters for api request or None
+		- ttl: optional time to live in milliseconds, same as fetch_data
+		- snapshot_name: file name of snapshot
+		- database: file name of the SQLite database the response is cached in
+	@returns
+		- snapshot: Snapshot, or None if there is no snapshot of the currently cached response
+	"""
+	if update:
+		return None
+
+	try:
+		snapshot = Snapshot(snapshot_name)
+	except (FileNotFoundError, ValueError, struct.error) as e:
+		print(f"No snapshot found... ({e})")
+		return None
+
+	key = get_cache_key(url, params)
+	with closing(get_connection(database)) as connection:
+		row = connection.execute("SELECT fetched FROM responses WHERE key = ?", (key,)).fetchone()
+
+	expired = row is not None and ttl is not None and row[0] < int(time.time() * 1000) - ttl
+	if row is None or row[0] != snapshot.fetched or snapshot.key != key or expired:
+		print("Snapshot is out of date...")
+		snapshot.close()
+		return None
+
+	count_cache(database, "hits")
+	print("Opened snapshot of local cache!")
+
+	return snapshot
+
+
+def get_update_flag(current_timestamp, cache, timeframe, database = CACHE_DATABASE): 
+	"""
+	Determine if cached responses need to be updated with new data from partsbox.
 
 	@params
 		- current_timestamp: the timestamp from when the get_timestamps function was called, 
 					         unix timestamp, in milliseconds (integer)
-		- cache: file name of cache 
+		- cache: name of the cached resource 
 		- timeframe: month or week (string), to determine timeframe in which the cache must be updated
+		- database: file name of the SQLite database
 	@returns 
-		- update: bool flag (set to true if the cache was last modified over a week ago, false otherwise)
+		- update: bool flag (set to true if the resource was last fetched before the timeframe or was never fetched, false otherwise)
 	"""
-	MILLI_PER_WEEK = 604800000
-	MILLI_PER_MONTH = 2629746000
+	difference = TTLS[timeframe]
 
-	if timeframe == "week": 
-		difference = MILLI_PER_WEEK
-	if timeframe == "month": 
-		difference = MILLI_PER_MONTH 
+	with closing(get_connection(database)) as connection:
+		row = connection.execute("SELECT MAX(fetched) FROM responses WHERE resource = ?", (cache,)).fetchone()
 
-	#get timestamp in seconds
-	modified_time = int(os.path.getmtime(cache))
+	modified_time = row[0]
 
-	#convert to milliseconds 
-	modified_time = modified_time * 1000
+	if modified_time is None: #never fetched
+		return True
 
 	update_time = current_timestamp - difference
 
@@ -83,4 +644,128 @@ def get_update_flag(current_timestamp, cache, timeframe):
 	else: #modified outside of the timeframe and needs to be updated
 		update = True
 
-	return update
\ No newline at end of file
+	return update
+
+
+def count_cache(database, outcome):
+	"""
+	Count a cache hit or miss for a database.
+
+	@params
+		- database: file name of the SQLite database
+		- outcome: "hits" or "misses"
+	@returns
+		- none
+	"""
+	with CACHE_STATS_LOCK:
+		stats = CACHE_STATS.setdefault(database, {"hits": 0, "misses": 0})
+		stats[outcome] += 1
+
+
+def get_cache_stats(database = None):
+	"""
+	Get the cache hit and miss counters for the current process.
+
+	@params
+		- database: optional file name of a SQLite database, None adds up the counters of every database
+	@returns
+		- stats: dictionary with the number of hits and misses
+	"""
+	with CACHE_STATS_LOCK:
+		if database is not None:
+			return dict(CACHE_STATS.get(database, {"hits": 0, "misses": 0}))
+
+		stats = {"hits": 0, "misses": 0}
+		for database_stats in CACHE_STATS.values():
+			for outcome, value in database_stats.items():
+				stats[outcome] += value
+
+	return stats
+
+
+def get_fingerprint(record):
+	"""
+	Get a fingerprint of a json record, used to detect changes between runs.
+
+	@params
+		- record: json data (dictionary, list or value)
+	@returns
+		- fingerprint: hex digest of the record, the same for records with equal content regardless of key order
+	"""
+	text = json.dumps(record, sort_keys = True, separators = (",", ":"), default = str)
+
+	return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def load_ledger(ledger_name):
+	"""
+	Load a sync ledger (dictionary of record keys to fingerprints).
+
+	@params
+		- ledger_name: file name of ledger
+	@returns
+		- ledger: dictionary stored in the ledger file, empty if the file does not exist or can not be read
+	"""
+	try:
+		with open(ledger_name, 'r') as file:
+			ledger = json.load(file)
+	except(FileNotFoundError, json.JSONDecodeError) as e:
+		print(f"No sync ledger found... ({e})")
+		ledger = {}
+
+	return ledger
+
+
+def save_ledger(ledger, ledger_name):
+	"""
+	Save a sync ledger, the file is replaced atomically so an interrupted run keeps the previous ledger.
+
+	@params
+		- ledger: dictionary of record keys to fingerprints
+		- ledger_name: file name of ledger
+	@returns
+		- none
+	"""
+	temp_name = ledger_name + ".tmp"
+
+	with open(temp_name, "w") as file:
+		json.dump(ledger, file)
+
+	os.replace(temp_name, ledger_name)
+
+
+def load_aggregates(database = CACHE_DATABASE):
+	"""
+	Load the stored aggregates of every part.
+
+	@params
+		- database: file name of the SQLite database
+	@returns
+		- aggregates: dictionary of part ids to dictionaries with the fingerprint, windows and body (decoded json) stored for the part
+	"""
+	with closing(get_connection(database)) as connection:
+		rows = connection.execute("SELECT part_id, fingerprint, windows, body FROM aggregates").fetchall()
+
+	aggregates = {row[0]: {"fingerprint": row[1], "windows": json.loads(row[2]), "body": json.loads(row[3])} for row in rows}
+
+	return aggregates
+
+
+def save_aggregates(aggregates, removed = (), database = CACHE_DATABASE):
+	"""
+	Store aggregates for parts and remove parts that no longer exist, in a single transaction.
+
+	@params
+		- aggregates: dictionary of part ids to dictionaries with the fingerprint, windows and body (json data) of the part
+		- removed: part ids to delete
+		- database: file name of the SQLite database
+	@returns
+		- none
+	"""
+	rows = ((part_id, aggregate["fingerprint"], json.dumps(aggregate["windows"]), json.dumps(aggregate["body"]))
+			for part_id, aggregate in aggregates.items())
+
+	with closing(get_connection(database)) as connection:
+		with connection:
+			connection.executemany("INSERT OR REPLACE INTO aggregates (part_id, fingerprint, windows, body) VALUES (?, ?, ?, ?)", rows)
+			connection.executemany("DELETE FROM aggregates WHERE part_id = ?", ((part_id,) for part_id in removed))
@@ -3,9 +3,8 @@ Module containing functions to complete necessary calculations for partsbox api
 
 """
 
+import ranking
 import time_stamp
-import pandas as pd
-import pydoc 
 
 
 def total_stock(parts):
@@ -35,61 +34,42 @@ def total_stock(parts):
 	return parts
 	
 
-def get_avg_batch(sorted_stock, Timestamps):
+def get_avg_batch(sorted_stock, Timestamps, windows = None):
 	"""
-	Calculate the average batch size for 4 time periods. 
+	Calculate the average batch size for each time period (1, 3, 6 and 12 months by default). 
 
 	@params 
 		- sorted_stock: sorted data from api response/cache 
 	  - Timestamps: dictionary of timestamps for the four time periods used and the current timestamp
 	                timestamps are unix timestamps, in milliseconds represented as integers 
+	  - windows: optional time_stamp.TimeWindows to use other time periods, built from Timestamps if not given 
 	@returns 
 		- sorted_stock: sorted data with dictionary of average batch sizes added 
 		
 	"""
-	for part in sorted_stock:
-		batch_totals = {"1_month": 0, "3_months": 0, "6_months": 0, "12_months": 0}
-		batch_averages = {"1_month": 0, "3_months": 0, "6_months": 0, "12_months": 0}
-		data_points = {"1_month": 0, "3_months": 0, "6_months": 0, "12_months": 0}
-		time_periods = ["1_month", "3_months", "6_months", "12_months"]
-
-		#if part has stock
-		batch_total = 0
-		stock_entry = 0
+	if windows is None:
+		windows = time_stamp.TimeWindows.from_timestamps(Timestamps)
 
-		part_stock = sorted_stock[part]["stock"]
+	time_periods = windows.names
 
-		for stock in part_stock:
-			timestamp = part_stock[stock_entry]["stock/timestamp"]
+	for part in sorted_stock:
+		batch_totals = dict.fromkeys(time_periods, 0)
+		data_points = dict.fromkeys(time_periods, 0)
 
-			#call get time period function 
-			time_period = time_stamp.get_current_timeperiod(timestamp, Timestamps)
+		part_stock = sorted_stock[part]["stock"]
+		timestamps = [stock["stock/timestamp"] for stock in part_stock]
 
-			if time_period: 
+		#get time period of every stock entry 
+		for stock, period_index in zip(part_stock, windows.get_indexes(timestamps)):
+			if period_index >= 0: 
+				time_period = time_periods[period_index]
 				#increase batch total based on time period 
-				batch_totals[time_period] = batch_totals[time_period] + sorted_stock[part]["stock"][stock_entry]["stock/quantity"]
+				batch_totals[time_period] = batch_totals[time_period] + stock["stock/quantity"]
 
 				#increase data points based on time period
 				data_points[time_period] = data_points[time_period] + 1
 
-			stock_entry += 1
-
-		#calculate cumulative values for batch totals and data points 
-		i = 1
-		while i <= 3:
-			batch_totals[time_periods[i]] = batch_totals[time_periods[i]] + batch_totals[time_periods[i-1]]
-			data_points[time_periods[i]] = data_points[time_periods[i]] + data_points[time_periods[i - 1]]
-			i += 1 
-
-
-		#calculate averages
-		i = 0
-		while i <= 3:
-			try:
-				batch_averages[time_periods[i]] = batch_totals[time_periods[i]] / data_points[time_periods[i]]
-			except ZeroDivisionError:
-				batch_averages[time_periods[i]] = 0
-			i += 1
+		batch_averages = get_period_averages(batch_totals, data_points)
 
 		average_for_calculations = get_weighted_average(batch_averages)
 
@@ -101,65 +81,39 @@ def get_avg_batch(sorted_stock, Timestamps):
 	return sorted_stock
 
 
-def get_avg_time(sorted_stock, Timestamps): 
+def get_avg_time(sorted_stock, Timestamps, windows = None): 
 	"""
-	Calculate the average time between batches for 4 time periods. 
+	Calculate the average time between batches for each time period (1, 3, 6 and 12 months by default). 
 
 	@params
 		- sorted_stock: dictionary of sorted data from api response/cache
 		- Timestamps: dictionary of timestamps for the four time periods used and the current timestamp
 	                timestamps are unix timestamps, in milliseconds represented as integers 
+		- windows: optional time_stamp.TimeWindows to use other time periods, built from Timestamps if not given 
 	@returns 
 		- sorted_stock: sorted stock data with dictionary of average times between batches added
 	"""
-	for part in sorted_stock: 
-		time_totals = {"1_month": 0, "3_months": 0, "6_months": 0, "12_months": 0}
-		time_averages = {"1_month": 0, "3_months": 0, "6_months": 0, "12_months": 0}
-		data_points = {"1_month": 0, "3_months": 0, "6_months": 0, "12_months": 0}
-		time_periods = ["1_month", "3_months", "6_months", "12_months"]
+	if windows is None:
+		windows = time_stamp.TimeWindows.from_timestamps(Timestamps)
 
-		part_stock = sorted_stock[part]["stock"]
-		stock_entry = 0
-		stock_history_size = len(part_stock)
-
-		for stock in part_stock:
-			timestamp = part_stock[stock_entry]["stock/timestamp"]
-			time_period = 0
-			next_stock_entry = stock_entry + 1
+	time_periods = windows.names
 
-			if next_stock_entry <= stock_history_size - 1:
-				next_timestamp = part_stock[next_stock_entry]["stock/timestamp"]
-				difference = time_stamp.get_difference(timestamp, next_timestamp)
-				time_period = time_stamp.get_similar_timeperiod(timestamp, next_timestamp, Timestamps)
+	for part in sorted_stock: 
+		time_totals = dict.fromkeys(time_periods, 0)
+		data_points = dict.fromkeys(time_periods, 0)
 
-			else: 
-				difference = 0
+		part_stock = sorted_stock[part]["stock"]
+		timestamps = [stock["stock/timestamp"] for stock in part_stock]
 
-			if time_period:
+		#each stock entry is paired with the next entry, the last entry has no pair 
+		for stock_entry, period_index in enumerate(windows.get_pair_indexes(timestamps)):
+			if period_index >= 0:
+				time_period = time_periods[period_index]
+				difference = time_stamp.get_difference(timestamps[stock_entry], timestamps[stock_entry + 1])
 				time_totals[time_period] = time_totals[time_period] + difference
 				data_points[time_period] = data_points[time_period] + 1
 
-			else:
-	 			pass
-
-			stock_entry += 1
-
-		#calculate cumulative values for batch totals and data points 
-		i = 1
-		while i <= 3:
-			time_totals[time_periods[i]] = time_totals[time_periods[i]] + time_totals[time_periods[i - 1]]
-			data_points[time_periods[i]] = data_points[time_periods[i]] + data_points[time_periods[i - 1]]
-			i += 1 
-
-
-		#calculate averages
-		i = 0
-		while i <= 3:
-			try:
-				time_averages[time_periods[i]] = time_totals[time_periods[i]] / data_points[time_periods[i]]
-			except ZeroDivisionError:
-				time_averages[time_periods[i]] = 0
-			i += 1
+		time_averages = get_period_averages(time_totals, data_points)
 
 		average_for_calculations = get_weighted_average(time_averages)
 
@@ -170,22 +124,56 @@ def get_avg_time(sorted_stock, Timestamps):
 	return sorted_stock
 
 
+def get_period_averages(totals, data_points):
+	"""
+	Calculate cumulative averages for each time period. 
+
+	Totals and data points of each time period are added to those of the longer time periods, 
+	so each average covers everything from the current time back to the start of its time period. 
+
+	@params
+		- totals: dictionary of totals for each time period, most recent first 
+		- data_points: dictionary of data point counts for each time period 
+	@returns 
+		- averages: dictionary of averages for each time period, 0 for time periods without data points
+	"""
+	time_periods = list(totals)
+	averages = {}
+	total = 0
+	points = 0
+
+	for time_period in time_periods: 
+		#calculate cumulative values for totals and data points 
+		total = total + totals[time_period]
+		points = points + data_points[time_period]
+
+		try:
+			averages[time_period] = total / points
+		except ZeroDivisionError:
+			averages[time_period] = 0
+
+	return averages
+
+
 def get_weighted_average(averages):
 	"""
-	Determine if 4 averages are similar or if weighted average must be calculated. 
+	Determine if the averages are similar or if weighted average must be calculated. 
+
+	The most recent time period has the highest weight (4, 3, 2, 1 for the default four time periods), 
+	leading time periods without data are left out of the weighted average. 
 
 	@params
-		- averages: a dictionary containing 4 averages for the 4 time periods
+		- averages: a dictionary containing an average for each time period, most recent first 
 	@returns
-		- average_for_calculations: weighted average if averages are not relatively similar, year average otherwise
+		- average_for_calculations: weighted average if averages are not relatively similar, average of the longest time period otherwise
 	"""	
-	time_periods = ["1_month", "3_months", "6_months", "12_months"]
-	year_average = averages["12_months"] 
+	time_periods = list(averages)
+	year_average = averages[time_periods[-1]] 
 
 	if year_average: #if there is data for the past year
 		tolerance = year_average * 0.15
-		lower_bound = int(averages["12_months"] - tolerance)
-		upper_bound = int(averages["12_months"] + tolerance)
+		lower_bound = int(year_average - tolerance)
+		upper_bound = int(year_average + tolerance)
 
 	else: 
 		year_average = 0
@@ -193,35 +181,29 @@ def get_weighted_average(averages):
 		lower_bound = 0
 		upper_bound = 0
 
-	#initalize variables for indexing, counts, and flags
-	weighted_flag = False
-	average_for_calculations = 0
-	i = 0
+	#count number of leading null or zero values, to be used as index into divisor list
 	zero_count = 0
+	while zero_count < len(time_periods) and averages[time_periods[zero_count]] == 0:
+		zero_count = zero_count + 1
 
-	for average in averages:
-		#count number of null or zero values, to be used as index into dizisor list
-		if averages[time_periods[i]] == 0:
-			zero_count = zero_count + 1
-			i += 1 
-
-	i = 0 
 	#determine if a weighted average needs to be calculated or if the 12 month average should be used
-	while not weighted_flag and i <= 3:
-		average = averages[time_periods[i]]
-
-		if average: 
-			if lower_bound <= average <= upper_bound:
-				weighted_flag = False
-			else: 
-				weighted_flag = True
+	weighted_flag = False
+	for time_period in time_periods: 
+		average = averages[time_period]
 
-		i += 1 
+		if average and not lower_bound <= average <= upper_bound: 
+			weighted_flag = True
+			break
 
-	divisor = [10, 6, 3, 1]
+	weights = range(len(time_periods), 0, -1)
 	if weighted_flag:
-		average_for_calculations = (averages["1_month"] * 4) + (averages ["3_months"] * 3) + (averages["6_months"] * 2) + (averages["12_months"] * 1)
-		average_for_calculations = average_for_calculations / divisor[zero_count]
+		average_for_calculations = 0
+		for time_period, weight in zip(time_periods, weights): 
+			average_for_calculations = average_for_calculations + (averages[time_period] * weight)
+
+		#divide by the weights of the time periods that have data 
+		divisor = sum(weights[zero_count:])
+		average_for_calculations = average_for_calculations / divisor
 
 	else: 
 		average_for_calculations = year_average
@@ -229,7 +211,7 @@ def get_weighted_average(averages):
 	return average_for_calculations
 
 
-def get_risk_level(sorted_stock, current_timestamp):
+def get_risk_level(sorted_stock, current_timestamp, index = None):
 	"""
 	Calculate the risk level of running out of each part.
 
@@ -242,6 +224,7 @@ def get_risk_level(sorted_stock, current_timestamp):
 	@params 
 		- sorted_stock: dictionary with all sorted_data and added feilds from previous calculations 
 		- current_timestamp: unix timestamp in milliseconds (integer) from when the program was run 
+		- index: optional dictionary, filled with ranked indexes of the parts (see ranking.build_index)
 	@returns
 		- sorted_stock: with added risk level and estimated time till no stock 
 	""" 
@@ -286,4 +269,7 @@ def get_risk_level(sorted_stock, current_timestamp):
 			elif estimated_rop > 90:
 				sorted_stock[part]["risk_level"] = "Low"
 
+	if index is not None: 
+		ranking.build_index(sorted_stock, index)
+
 	return sorted_stock
\ No newline at end of file
@@ -0,0 +1,340 @@
+"""
+Module containing a columnar (NumPy) engine for the calculations in the calculate module.
+
+The stock history of every part is flattened into contiguous int64 arrays with per part offsets,
+so batch averages, time averages, weighted averages and risk levels are computed for all parts at once.
+Results are identical to the functions in the calculate module, which remain the reference implementation.
+
+"""
+
+import numpy as np
+import model
+import ranking
+import time_stamp
+
+
+MILLI_PER_DAY = 86400000
+
+
+def get_columns(sorted_stock):
+	"""
+	Flatten the stock history of every part into contiguous arrays.
+
+	@params
+		- sorted_stock: dictionary of sorted data from api response/cache
+	@returns
+		- columns: dictionary containing
+			- part_ids: list of part ids, in the order of sorted_stock
+			- offsets: int64 array, stock entries for part i are at [offsets[i], offsets[i + 1])
+			- timestamps: int64 array of stock timestamps, unix timestamps in milliseconds
+			- quantities: int64 array of stock quantities
+	"""
+	part_ids = list(sorted_stock)
+	number_of_parts = len(part_ids)
+
+	lengths = np.fromiter((len(sorted_stock[part]["stock"]) for part in part_ids), dtype = np.int64, count = number_of_parts)
+	offsets = np.zeros(number_of_parts + 1, dtype = np.int64)
+	np.cumsum(lengths, out = offsets[1:])
+	number_of_entries = int(offsets[-1])
+
+	histories = [sorted_stock[part]["stock"] for part in part_ids]
+
+	if all(isinstance(history, model.StockHistory) for history in histories): #compact form, copy the array columns directly
+		timestamps = np.concatenate([np.frombuffer(history.timestamps, dtype = np.int64) for history in histories] or [np.zeros(0, np.int64)])
+		quantities = np.concatenate([np.frombuffer(history.quantities, dtype = np.int64) for history in histories] or [np.zeros(0, np.int64)])
+	else:
+		timestamps = np.fromiter((stock["stock/timestamp"] for history in histories for stock in history),
+								 dtype = np.int64, count = number_of_entries)
+		quantities = np.fromiter((stock["stock/quantity"] for history in histories for stock in history),
+								 dtype = np.int64, count = number_of_entries)
+
+	columns = {"part_ids": part_ids, "offsets": offsets, "timestamps": timestamps, "quantities": quantities}
+
+	return columns
+
+
+def get_current_timeperiods(timestamps, windows):
+	"""
+	Vectorized time_stamp.TimeWindows.get_indexes, using binary search over the time period boundaries.
+
+	@params
+		- timestamps: int64 array of unix timestamps in milliseconds
+		- windows: time_stamp.TimeWindows
+	@returns
+		- periods: int8 array of indexes into windows.names, -1 for timestamps outside of every time period
+	"""
+	ascending = np.array(windows.ascending, dtype = np.int64)
+	positions = np.searchsorted(ascending, timestamps, side = "left")
+
+	#timestamps before the oldest boundary, after the current time, or on a boundary are not in a time period
+	inside = (positions > 0) & (positions < len(ascending))
+	inside[inside] = ascending[positions[inside]] != timestamps[inside]
+
+	periods = np.where(inside, len(windows.names) - positions, -1).astype(np.int8)
+
+	return periods
+
+
+def get_similar_timeperiods(timestamps_1, timestamps_2, windows):
+	"""
+	Vectorized time_stamp.TimeWindows.get_pair_index.
+
+	@params
+		- timestamps_1: int64 array of first timestamps
+		- timestamps_2: int64 array of second timestamps
+		- windows: time_stamp.TimeWindows
+	@returns
+		- periods: int8 array of indexes into windows.names, -1 if the pair is not within the same time period
+	"""
+	boundaries = np.array(windows.boundaries, dtype = np.int64)
+	periods = get_current_timeperiods(timestamps_1, windows)
+
+	#second timestamp must be between the start of the first timestamp's time period and the current time
+	in_period = periods >= 0
+	period_starts = boundaries[np.where(in_period, periods, 0) + 1]
+	in_period = in_period & (timestamps_2 > period_starts) & (timestamps_2 < boundaries[0])
+
+	return np.where(in_period, periods, -1).astype(np.int8)
+
+
+def get_period_totals(columns, entry_parts, values, periods, number_of_periods):
+	"""
+	Sum values and count data points per part and time period, cumulative over the time periods.
+
+	@params
+		- columns: dictionary from get_columns
+		- entry_parts: int64 array with the part index of every value
+		- values: int64 array of values to be summed
+		- periods: int8 array of time period indexes, -1 for values to be skipped
+		- number_of_periods: number of time periods
+	@returns
+		- totals: int64 array (parts x time periods) of cumulative totals
+		- data_points: int64 array (parts x time periods) of cumulative data point counts
+	"""
+	number_of_parts = len(columns["part_ids"])
+	in_period = periods >= 0
+	keys = entry_parts[in_period] * number_of_periods + periods[in_period]
+
+	totals = np.zeros(number_of_parts * number_of_periods, dtype = np.int64)
+	np.add.at(totals, keys, values[in_period])
+	data_points = np.bincount(keys, minlength = number_of_parts * number_of_periods).astype(np.int64)
+
+	totals = np.cumsum(totals.reshape(number_of_parts, number_of_periods), axis = 1)
+	data_points = np.cumsum(data_points.reshape(number_of_parts, number_of_periods), axis = 1)
+
+	return totals, data_points
+
+
+def get_averages(totals, data_points):
+	"""
+	Divide totals by data points, an average is 0 where there are no data points.
+
+	@params
+		- totals: int64 array (parts x time periods)
+		- data_points: int64 array (parts x time periods)
+	@returns
+		- averages: float64 array (parts x time periods)
+	"""
+	averages = np.zeros(totals.shape, dtype = np.float64)
+	np.divide(totals, data_points, out = averages, where = data_points > 0)
+
+	return averages
+
+
+def get_weighted_average(averages):
+	"""
+	Vectorized calculate.get_weighted_average.
+
+	@params
+		- averages: float64 array (parts x time periods) of the averages for each part, most recent time period first
+	@returns
+		- average_for_calculations: float64 array of weighted averages if averages are not relatively similar, year average otherwise
+		- is_int: bool array, True where calculate.get_weighted_average returns the integer 0
+	"""
+	number_of_periods = averages.shape[1]
+	year_average = averages[:, -1]
+	tolerance = year_average * 0.15
+	lower_bound = np.trunc(year_average - tolerance)[:, None]
+	upper_bound = np.trunc(year_average + tolerance)[:, None]
+
+	non_zero = averages != 0
+	#number of leading zero averages, used as index into divisor list
+	zero_count = np.where(non_zero.any(axis = 1), non_zero.argmax(axis = 1), number_of_periods)
+	weighted_flag = (non_zero & ((averages < lower_bound) | (averages > upper_bound))).any(axis = 1)
+
+	#weights are highest for the most recent time period, summed in the same order as calculate.get_weighted_average
+	weights = range(number_of_periods, 0, -1)
+	weighted_average = np.zeros(len(averages), dtype = np.float64)
+	for i, weight in enumerate(weights):
+		weighted_average = weighted_average + averages[:, i] * weight
+
+	#divisor is the sum of the weights of time periods that have data, indexed by number of leading zero averages
+	#the extra entry is never used in a weighted average
+	divisor = np.array([sum(weights[i:]) for i in range(number_of_periods)] + [1])
+	weighted_average = weighted_average / divisor[zero_count]
+
+	average_for_calculations = np.where(weighted_flag, weighted_average, year_average)
+	is_int = ~weighted_flag & (year_average == 0)
+
+	return average_for_calculations, is_int
+
+
+def add_averages(sorted_stock, columns, averages, data_points, key, time_periods):
+	"""
+	Add averages and the average for calculations to every part in sorted_stock.
+
+	@params
+		- sorted_stock: dictionary of sorted data
+		- columns: dictionary from get_columns
+		- averages: float64 array (parts x time periods)
+		- data_points: int64 array (parts x time periods)
+		- key: "batch" or "time", prefix of the keys added to each part
+		- time_periods: names of the time periods
+	@returns
+		- sorted_stock: with "<key>/averages" and "<key>/average_for_calculations" added
+	"""
+	average_for_calculations, is_int = get_weighted_average(averages)
+
+	#convert back to python numbers, averages without data points are the integer 0 in the calculate module
+	averages = averages.tolist()
+	has_data = (data_points > 0).tolist()
+	average_for_calculations = average_for_calculations.tolist()
+	is_int = is_int.tolist()
+
+	for part_index, part in enumerate(columns["part_ids"]):
+		part_averages = {}
+		for i, time_period in enumerate(time_periods):
+			part_averages[time_period] = averages[part_index][i] if has_data[part_index][i] else 0
+
+		sorted_stock[part][key + "/averages"] = part_averages
+		sorted_stock[part][key + "/average_for_calculations"] = 0 if is_int[part_index] else average_for_calculations[part_index]
+
+	return sorted_stock
+
+
+def get_entry_parts(columns):
+	"""
+	Get the part index of every stock entry.
+
+	@params
+		- columns: dictionary from get_columns
+	@returns
+		- entry_parts: int64 array, same length as the timestamp column
+	"""
+	lengths = np.diff(columns["offsets"])
+
+	return np.repeat(np.arange(len(lengths), dtype = np.int64), lengths)
+
+
+def get_avg_batch(sorted_stock, Timestamps, columns = None, windows = None):
+	"""
+	Calculate the average batch size for each time period, for all parts at once.
+
+	@params
+		- sorted_stock: sorted data from api response/cache
+		- Timestamps: dictionary of timestamps for the four time periods used and the current timestamp
+		- columns: optional dictionary from get_columns, built from sorted_stock if not given
+		- windows: optional time_stamp.TimeWindows to use other time periods, built from Timestamps if not given
+	@returns
+		- sorted_stock: sorted data with dictionary of average batch sizes added
+	"""
+	if columns is None:
+		columns = get_columns(sorted_stock)
+	if windows is None:
+		windows = time_stamp.TimeWindows.from_timestamps(Timestamps)
+
+	number_of_periods = len(windows.names)
+	periods = get_current_timeperiods(columns["timestamps"], windows)
+	totals, data_points = get_period_totals(columns, get_entry_parts(columns), columns["quantities"], periods, number_of_periods)
+
+	return add_averages(sorted_stock, columns, get_averages(totals, data_points), data_points, "batch", windows.names)
+
+
+def get_avg_time(sorted_stock, Timestamps, columns = None, windows = None):
+	"""
+	Calculate the average time between batches for each time period, for all parts at once.
+
+	@params
+		- sorted_stock: dictionary of sorted data from api response/cache
+		- Timestamps: dictionary of timestamps for the four time periods used and the current timestamp
+		- columns: optional dictionary from get_columns, built from sorted_stock if not given
+		- windows: optional time_stamp.TimeWindows to use other time periods, built from Timestamps if not given
+	@returns
+		- sorted_stock: sorted stock data with dictionary of average times between batches added
+	"""
+	if columns is None:
+		columns = get_columns(sorted_stock)
+	if windows is None:
+		windows = time_stamp.TimeWindows.from_timestamps(Timestamps)
+
+	timestamps = columns["timestamps"]
+	entry_parts = get_entry_parts(columns)
+
+	#pair every entry with the next entry, dropping pairs that cross into the next part
+	timestamps_1 = timestamps[:-1]
+	timestamps_2 = timestamps[1:]
+	same_part = entry_parts[:-1] == entry_parts[1:]
+
+	differences = np.trunc((timestamps_2 - timestamps_1) / MILLI_PER_DAY).astype(np.int64)
+	periods = get_similar_timeperiods(timestamps_1, timestamps_2, windows)
+	periods[~same_part] = -1
+
+	number_of_periods = len(windows.names)
+	totals, data_points = get_period_totals(columns, entry_parts[:-1], differences, periods, number_of_periods)
+
+	return add_averages(sorted_stock, columns, get_averages(totals, data_points), data_points, "time", windows.names)
+
+
+def get_risk_level(sorted_stock, current_timestamp, index = None):
+	"""
+	Calculate the risk level of running out of each part, for all parts at once.
+
+	See calculate.get_risk_level for the risk scale.
+
+	@params
+		- sorted_stock: dictionary with all sorted_data and added feilds from previous calculations
+		- current_timestamp: unix timestamp in milliseconds (integer) from when the program was run
+		- index: optional dictionary, filled with ranked indexes of the parts (see ranking.build_index)
+	@returns
+		- sorted_stock: with added risk level and estimated time till no stock
+	"""
+	part_ids = list(sorted_stock)
+	number_of_parts = len(part_ids)
+
+	def column(key, dtype):
+		return np.fromiter((sorted_stock[part][key] for part in part_ids), dtype = dtype, count = number_of_parts)
+
+	current_stock = np.abs(column("total_stock", np.int64))
+	avg_batch = np.abs(column("batch/average_for_calculations", np.float64))
+	avg_time = column("time/average_for_calculations", np.float64)
+	time_is_int = np.fromiter((isinstance(sorted_stock[part]["time/average_for_calculations"], int) for part in part_ids),
+							  dtype = bool, count = number_of_parts)
+	last_batch = column("days_since_last_batch", np.int64)
+	lead_time = column("lead_time_(weeks)", np.int64) * 7 #convert from weeks to days
+
+	time_difference = np.trunc(last_batch - avg_time)
+	time_till_next_batch = np.where(last_batch >= avg_time, -np.abs(time_difference), np.abs(time_difference))
+
+	#calculate.get_risk_level rounds the number of batches to 1 whenever there is stock and a batch size
+	number_of_batches = ((current_stock > 0) & (avg_batch != 0)).astype(np.int64)
+
+	estimated_rop = np.where(number_of_batches == 0, time_till_next_batch - lead_time, number_of_batches * avg_time - lead_time)
+	rop_is_int = (number_of_batches == 0) | time_is_int
+
+	risk_level = np.select([(avg_time == 0) | (avg_batch == 0), estimated_rop < 0, estimated_rop <= 30, estimated_rop <= 90],
+						   ["Not enough data", "Overdue for batch", "High", "Medium"],
+						   default = "Low")
+
+	estimated_rop = estimated_rop.tolist()
+	rop_is_int = rop_is_int.tolist()
+	risk_level = risk_level.tolist()
+
+	for part_index, part in enumerate(part_ids):
+		rop = estimated_rop[part_index]
+		sorted_stock[part]["risk_level"] = risk_level[part_index]
+		sorted_stock[part]["estimated_rop"] = int(rop) if rop_is_int[part_index] else rop
+
+	if index is not None: 
+		ranking.build_index(sorted_stock, index)
+
+	return sorted_stock
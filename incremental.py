@@ -0,0 +1,155 @@
+"""
+Module that keeps batch and time averages between runs so only parts whose stock history changed are recalculated.
+
+The averages of each part are stored in the cache database with a fingerprint of its stock history and the position of
+its stock entries around each time period boundary. A part is recalculated when its fingerprint changes or when a
+boundary has moved past one of its stock entries (its time windows rolled over), every other part uses the stored averages.
+
+"""
+
+import importlib
+from bisect import bisect_left, bisect_right
+import cache
+import time_stamp
+
+
+ENGINES = ("calculate", "columnar") #modules that can be used for the averages
+#fields stored for each part
+AVERAGE_FIELDS = ("batch/averages", "batch/average_for_calculations", "time/averages", "time/average_for_calculations")
+
+
+def get_history_fingerprint(history):
+	"""
+	Get a fingerprint of a stock history, used to detect new or changed stock entries.
+
+	@params
+		- history: stock history of a part (list of stock entries or model.StockHistory)
+	@returns
+		- fingerprint: string made from the number of entries, the last timestamp and the sum of the quantities
+	"""
+	if not len(history):
+		return "0"
+
+	total = sum(stock["stock/quantity"] for stock in history)
+
+	return f"{len(history)}:{history[-1]['stock/timestamp']}:{total}"
+
+
+def get_gaps(timestamps, boundaries):
+	"""
+	Find the stock entries on either side of each time period boundary.
+
+	@params
+		- timestamps: list of unix timestamps, in milliseconds (integers), of the stock entries of a part
+		- boundaries: time period boundaries (time_stamp.TimeWindows.boundaries)
+	@returns
+		- gaps: list with [boundary, latest timestamp before it or None, earliest timestamp after it or None] for every boundary,
+		        an entry on a boundary gives the boundary itself on both sides
+	"""
+	timestamps = sorted(timestamps)
+	gaps = []
+
+	for boundary in boundaries:
+		below = bisect_left(timestamps, boundary)
+		above = bisect_right(timestamps, boundary)
+
+		if below != above: #entry on the boundary
+			gaps.append([boundary, boundary, boundary])
+		else:
+			gaps.append([boundary, timestamps[below - 1] if below else None, timestamps[above] if above < len(timestamps) else None])
+
+	return gaps
+
+
+def is_rolled_over(gaps, boundaries):
+	"""
+	Determine if any time period boundary has moved past a stock entry since the gaps were found.
+
+	Averages only depend on which period each stock entry falls in, so they stay the same while every boundary stays
+	strictly between the same two entries.
+
+	@params
+		- gaps: list from get_gaps for the boundaries the averages were calculated with
+		- boundaries: current time period boundaries
+	@returns
+		- rolled_over: bool, True if the averages have to be recalculated
+	"""
+	if len(gaps) != len(boundaries):
+		return True
+
+	for (old_boundary, below, above), boundary in zip(gaps, boundaries):
+		if boundary == old_boundary:
+			continue
+		if (below is not None and boundary <= below) or (above is not None and boundary >= above):
+			return True
+
+	return False
+
+
+def get_averages(sorted_stock, Timestamps, windows = None, engine = "calculate", full = False, workers = 1, database = cache.CACHE_DATABASE):
+	"""
+	Add batch and time averages to every part, recalculating only parts that changed since the last run.
+
+	Gives the same result as calculate.get_avg_batch followed by calculate.get_avg_time.
+
+	@params
+		- sorted_stock: nested dictionary containg data for all valid parts
+		- Timestamps: dictionary of timestamps for the time periods used and the current timestamp
+		- windows: optional time_stamp.TimeWindows to use other time periods, built from Timestamps if not given
+		- engine: name of the module used for the averages (see ENGINES)
+		- full: bool flag (set to true to recalculate every part, the stored averages are still replaced)
+		- workers: number of processes used to recalculate parts (see parallel.get_analytics)
+		- database: file name of the SQLite database the averages are stored in
+	@returns
+		- result: dictionary with sorted_stock and the number of parts recalculated, skipped (stored averages used)
+		          and removed (parts no longer in sorted_stock)
+	"""
+	if engine not in ENGINES:
+		raise ValueError(f"unknown analytics engine {engine}, expected one of {ENGINES}")
+
+	if windows is None:
+		windows = time_stamp.TimeWindows.from_timestamps(Timestamps)
+
+	stored = cache.load_aggregates(database)
+	fingerprints = {}
+	changed_stock = {}
+	skipped = 0
+
+	for part in sorted_stock:
+		history = sorted_stock[part]["stock"]
+		fingerprints[part] = get_history_fingerprint(history)
+		aggregate = stored.get(part)
+
+		if (full or aggregate is None or aggregate["fingerprint"] != fingerprints[part] or aggregate["windows"]["names"] != windows.names
+				or is_rolled_over(aggregate["windows"]["gaps"], windows.boundaries)):
+			changed_stock[part] = sorted_stock[part]
+		else:
+			for field in AVERAGE_FIELDS:
+				sorted_stock[part][field] = aggregate["body"][field]
+			skipped += 1
+
+	if changed_stock:
+		if workers > 1:
+			import parallel #multiprocessing is only loaded when worker processes are used
+
+			parallel.get_analytics(changed_stock, Timestamps, workers = workers, windows = windows, engine = engine)
+		else:
+			analytics = importlib.import_module(engine)
+			analytics.get_avg_batch(changed_stock, Timestamps, windows = windows)
+			analytics.get_avg_time(changed_stock, Timestamps, windows = windows)
+
+	#store the averages of recalculated parts with the gaps around the boundaries they were calculated with
+	aggregates = {}
+	for part in changed_stock:
+		timestamps = [stock["stock/timestamp"] for stock in changed_stock[part]["stock"]]
+		aggregates[part] = {"fingerprint": fingerprints[part],
+							"windows": {"names": windows.names, "gaps": get_gaps(timestamps, windows.boundaries)},
+							"body": {field: changed_stock[part][field] for field in AVERAGE_FIELDS}}
+
+	removed = [part for part in stored if part not in sorted_stock]
+	cache.save_aggregates(aggregates, removed, database)
+
+	print(f"averages recalculated for {len(changed_stock)} parts, {skipped} unchanged parts skipped, {len(removed)} removed")
+	result = {"sorted_stock": sorted_stock, "recalculated": len(changed_stock), "skipped": skipped, "removed": len(removed)}
+
+	return result
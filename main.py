@@ -3,17 +3,24 @@ Main module for partsbox api interface.
 
 """
 
+import argparse
 import json 
-import requests 
+import os
+from concurrent.futures import ThreadPoolExecutor
 import sort_data
 import calculate
 import time_stamp
 import cache
+import incremental
+import partsbox
+import pipeline
+import profiler
 
 
 #constants for indexing into partsbox config list
 WRITE = 0
 READ = 1
+ACCOUNTS_DIRECTORY = "accounts" #each account of a multi account config keeps its caches and report in a directory here
 
 
 def jprint(obj):
@@ -29,11 +36,296 @@ def jprint(obj):
 	print(text)
 
 
+def get_stock(update, headers, client, tenant):
+	"""
+	Get sorted stock data from the binary snapshot, the cache or PartsBox. 
+
+	@params
+		- update: bool flag (set to true if update to cache is required, false otherwise)
+		- headers: headers for api request, including read only authorization/api key
+		- client: PartsBoxClient used if the parts have to be fetched 
+		- tenant: dictionary of file names for the account (see get_tenant)
+	@returns
+		- sorted_stock: nested dictionary containg data for all valid parts 
+		- missing_leads: list of parts with stock history but without a valid lead time 
+		- fetched: time the parts were fetched from PartsBox (milliseconds) 
+	"""
+	url = client.get_url("part/all")
+	json_cache = "request_cache.json"
+	missing_leads = []
+
+	#use the binary snapshot of the cached response if it is still valid
+	snapshot = cache.get_snapshot(update = update, url = url, params = None, snapshot_name = tenant["snapshot"], database = tenant["database"])
+
+	if snapshot is not None:
+		with snapshot:
+			sorted_stock = sort_data.scan_snapshot(snapshot, missing_leads)
+			fetched = snapshot.fetched
+	else:
+		#parts are parsed one at a time from the cache or api response, unused fields are dropped
+		parts = cache.stream_data(update = update,
+								  json_cache = json_cache,
+								  url = url, 
+								  headers = headers,
+								  params = None,
+								  snapshot_name = tenant["snapshot"],
+								  client = client,
+								  database = tenant["database"])
+		sorted_stock = sort_data.scan_stock(parts, missing_parts = missing_leads)
+		#the response is cached once every part has been read
+		fetched = cache.get_fetched(url, None, tenant["database"])
+
+	return sorted_stock, missing_leads, fetched
+
+
+def get_averages(sorted_stock, Timestamps, workers, full, database = cache.CACHE_DATABASE): 
+	"""
+	Add batch and time averages to sorted data, see incremental.get_averages. 
+
+	@params
+		- sorted_stock: nested dictionary containg data for all valid parts 
+		- Timestamps: dictionary of timestamps for the time periods used and the current timestamp
+		- workers: number of processes used to recalculate parts 
+		- full: bool flag (set to true to recalculate every part)
+		- database: file name of the SQLite database the averages are stored in 
+	@returns
+		- sorted_stock: sorted data with averages added 
+		- result: dictionary with the number of parts recalculated, skipped and removed 
+	"""
+	result = incremental.get_averages(sorted_stock, Timestamps, full = full, workers = workers, database = database)
+	sorted_stock = result.pop("sorted_stock")
+
+	return sorted_stock, result
+
+
+def get_risk_level(sorted_stock, Timestamps): 
+	"""
+	Add risk levels to sorted data and build the ranked indexes, see calculate.get_risk_level. 
+
+	@params
+		- sorted_stock: nested dictionary containg data for all valid parts 
+		- Timestamps: dictionary of timestamps for the time periods used and the current timestamp
+	@returns
+		- sorted_stock: sorted data with risk levels added 
+		- index: dictionary from ranking.build_index 
+	"""
+	index = {}
+	sorted_stock = calculate.get_risk_level(sorted_stock, Timestamps[0], index)
+
+	return sorted_stock, index
+
+
+def get_accounts(config): 
+	"""
+	Get the accounts listed in the partsbox config.
+
+	The config is either the list of api keys of one account (see WRITE and READ), which uses the files 
+	in the working directory, or a dictionary listing several accounts: 
+		{"accounts": [{"name": "main", "partsbox": [write key, read key], "airtable": {"Authorization": ..., "URL": ...}}, ...]}
+	an account can also set "base_url" to use another PartsBox server. 
+
+	@params
+		- config: data of the partsbox config file 
+	@returns
+		- accounts: list of dictionaries with the name (None for a single account config), partsbox api keys, 
+		            airtable config (None to read airtable_config.json) and optional base_url of each account 
+	"""
+	if isinstance(config, list): 
+		accounts = [{"name": None, "partsbox": config, "airtable": None}]
+		return accounts
+
+	accounts = config["accounts"]
+	names = set()
+	for account in accounts: 
+		name = account.get("name")
+		#names are used as directory names 
+		if not name or name in (".", "..") or os.sep in name or "/" in name: 
+			raise ValueError(f"invalid account name {name!r}, names must be non empty and can not contain path separators")
+		if name in names: 
+			raise ValueError(f"account {name} is listed more than once")
+		if "airtable" not in account: 
+			raise ValueError(f"account {name} has no airtable config")
+		names.add(name)
+
+	return accounts
+
+
+def get_tenant(account): 
+	"""
+	Get the file names used by an account, every account gets its own caches, snapshot, sync ledger and run report. 
+
+	@params
+		- account: dictionary from get_accounts 
+	@returns
+		- tenant: dictionary with the account name, its airtable config and the file names of its 
+		          cache database, snapshot, bom cache, sync ledger, lead time ledger and run report 
+	"""
+	name = account["name"]
+	directory = "" if name is None else os.path.join(ACCOUNTS_DIRECTORY, name)
+	if directory: 
+		os.makedirs(directory, exist_ok = True)
+
+	tenant = {"name": name, 
+			  "airtable": account["airtable"],
+			  "database": os.path.join(directory, cache.CACHE_DATABASE),
+			  "snapshot": os.path.join(directory, cache.SNAPSHOT_NAME),
+			  "bom_cache": os.path.join(directory, sort_data.BOM_CACHE),
+			  "ledger": os.path.join(directory, sort_data.AIRTABLE_LEDGER),
+			  "lead_time_ledger": os.path.join(directory, sort_data.LEAD_TIME_LEDGER),
+			  "report": os.path.join(directory, profiler.RUN_REPORT)}
+
+	return tenant
+
+
+def get_stages(analytics_workers = 1, full_recalculation = False, tenant = None, dry_run_lead_times = False): 
+	"""
+	Get the stages of a run. 
+
+	The stock analytics path (scan, lead times, averages, risk level) and the project crawl (projects, boms) 
+	only join at update_project_data, so they run at the same time. Each analytics stage updates 
+	sorted_stock in place, the stages are chained through a differently named output for each step 
+	so they always run one after another. Stages that output sorted_stock count its parts as their items. 
+
+	@params
+		- analytics_workers: number of processes used to recalculate averages 
+		- full_recalculation: bool flag (set to true to recalculate the averages of every part instead of only changed parts)
+		- tenant: optional dictionary of file names for the account (see get_tenant), defaults to the files in the working directory
+		- dry_run_lead_times: bool flag (set to true to only report the lead times that would be written to PartsBox)
+	@returns
+		- stages: list of pipeline.Stage, the initial values are client, read_headers and write_headers
+	"""
+	if tenant is None: 
+		tenant = get_tenant({"name": None, "airtable": None})
+
+	stages = [pipeline.Stage("get_timestamps", time_stamp.get_timestamps, 
+							 outputs = ("Timestamps",)),
+			  pipeline.Stage("get_update_flag", lambda Timestamps: cache.get_update_flag(Timestamps[0], "request_cache.json", "week", tenant["database"]), 
+							 inputs = ("Timestamps",), outputs = ("update",)),
+			  #single pass stock scan (total stock, last restock, sort and removing empty stock lists)
+			  pipeline.Stage("scan_stock", lambda update, headers, client: get_stock(update, headers, client, tenant), 
+							 inputs = ("update", "read_headers", "client"), outputs = ("sorted_stock/scanned", "missing_leads", "parts_fetched"), items = len),
+			  #lead times only change the parts in missing_leads, nothing waits on them
+			  pipeline.Stage("update_lead_times", lambda missing_leads, fetched, headers, client: sort_data.update_lead_times(missing_leads, headers, dry_run_lead_times, client = client, ledger_name = tenant["lead_time_ledger"], fetched = fetched), 
+							 inputs = ("missing_leads", "parts_fetched", "write_headers", "client"), outputs = ("lead_time_result",), items = lambda result: result["planned"]),
+			  #averages are only recalculated for parts whose stock history changed or whose time windows rolled over 
+			  pipeline.Stage("get_averages", lambda sorted_stock, Timestamps: get_averages(sorted_stock, Timestamps, analytics_workers, full_recalculation, tenant["database"]), 
+							 inputs = ("sorted_stock/scanned", "Timestamps"), outputs = ("sorted_stock/time", "averages_result"), items = len),
+			  pipeline.Stage("get_time_since_last_batch", lambda sorted_stock, Timestamps: time_stamp.get_time_since_last_batch(Timestamps[0], sorted_stock), 
+							 inputs = ("sorted_stock/time", "Timestamps"), outputs = ("sorted_stock/last_batch",), items = len),
+			  #ranked indexes (see ranking) are built with the risk levels, for top N and range queries 
+			  pipeline.Stage("get_risk_level", get_risk_level, 
+							 inputs = ("sorted_stock/last_batch", "Timestamps"), outputs = ("sorted_stock/risk", "risk_index"), items = len),
+			  #project crawl 
+			  pipeline.Stage("get_projects", lambda headers, Timestamps, client: sort_data.get_projects(headers, Timestamps[0], client = client, database = tenant["database"])["projects"], 
+							 inputs = ("write_headers", "Timestamps", "client"), outputs = ("projects",)),
+			  pipeline.Stage("get_boms", lambda projects, headers, client: sort_data.get_boms(projects, headers, client = client, cache_name = tenant["bom_cache"]), 
+							 inputs = ("projects", "write_headers", "client"), outputs = ("project_boms",)),
+			  pipeline.Stage("build_project_index", sort_data.build_project_index, 
+							 inputs = ("project_boms",), outputs = ("project_index",), items = lambda index: len(index["projects"])),
+			  #both paths join here 
+			  pipeline.Stage("update_project_data", sort_data.update_project_data, 
+							 inputs = ("project_boms", "sorted_stock/risk", "project_index"), outputs = ("sorted_stock",), items = len),
+			  #records are generated as push_to_airtable batches them, so this stage only sets up the generator 
+			  pipeline.Stage("get_data_for_airtable", sort_data.iter_airtable_records, 
+							 inputs = ("sorted_stock",), outputs = ("airtable_data",)),
+			  pipeline.Stage("push_to_airtable", lambda airtable_data: sort_data.push_to_airtable(airtable_data, config = tenant["airtable"], ledger_name = tenant["ledger"]), 
+							 inputs = ("airtable_data",), outputs = ("airtable_result",), items = lambda result: result["pushed"])]
+
+	return stages
+
+
+def run_account(account, client, stages, analytics_workers = 1, full_recalculation = False, workers = pipeline.WORKERS, dry_run_lead_times = False): 
+	"""
+	Run every stage for one account. 
+
+	@params
+		- account: dictionary from get_accounts 
+		- client: PartsBoxClient for the account 
+		- stages: profiler.StageProfiler every stage of the account is measured by 
+		- analytics_workers: number of processes used to recalculate averages 
+		- full_recalculation: bool flag (set to true to recalculate the averages of every part)
+		- workers: number of stages run at once 
+		- dry_run_lead_times: bool flag (set to true to only report the lead times that would be written to PartsBox)
+	@returns
+		- values: dictionary of every stage output (see get_stages)
+	"""
+	tenant = get_tenant(account)
+	keys = account["partsbox"]
+
+	values = {"client": client,
+			  #api key for read only access
+			  "read_headers": {"Authorization": keys[READ]["API_key"], "Content-Type" : "application/json"}, 
+			  #api key for writing, used to update lead times and get projects
+			  "write_headers": {"Authorization": keys[WRITE]["API_key"]}}
+
+	values = pipeline.run(get_stages(analytics_workers, full_recalculation, tenant, dry_run_lead_times), values, workers = workers, profiler = stages)
+
+	return values
+
+
+def run_tenant(account, client, stages, analytics_workers = 1, full_recalculation = False, workers = pipeline.WORKERS, dry_run_lead_times = False): 
+	"""
+	Run every stage for one account of a multi account config, closing its client and profiler when the run ends (even if it fails). 
+
+	@params
+		- account: dictionary from get_accounts
+		- client: PartsBoxClient for the account, closed when the run ends
+		- stages: profiler.StageProfiler every stage of the account is measured by, closed when the run ends
+		- analytics_workers: number of processes used to recalculate averages
+		- full_recalculation: bool flag (set to true to recalculate the averages of every part)
+		- workers: number of stages run at once
+		- dry_run_lead_times: bool flag (set to true to only report the lead times that would be written to PartsBox)
+	@returns
+		- values: dictionary of every stage output (see get_stages)
+	"""
+	try: 
+		return run_account(account, client, stages, analytics_workers, full_recalculation, workers, dry_run_lead_times)
+	finally: 
+		#pooled connections and memory tracing would otherwise stay open while the other accounts run 
+		client.close()
+		stages.close()
+
+
+def print_summary(values, client, name = None): 
+	"""
+	Print the results of a run. 
+
+	@params
+		- values: dictionary returned by run_account 
+		- client: PartsBoxClient used for the run 
+		- name: optional account name, added to the start of every line 
+	@returns
+		- none
+	"""
+	prefix = "" if name is None else f"[{name}] "
+
+	result = values["lead_time_result"]
+	if result["dry_run"]: 
+		print(f"{prefix}planned {result['planned']} lead time updates (dry run, nothing written), {result['skipped']} already updated")
+	else: 
+		print(f"{prefix}updated {result['updated']} of {result['planned']} lead times, {result['failed']} failed, {result['skipped']} already updated")
+	index = values["project_index"]
+	at_risk = [project for project in index["projects"] if sort_data.get_project_parts(index, values["sorted_stock"], project)]
+	print(f"{prefix}{len(at_risk)} of {len(index['projects'])} projects use parts with a high or overdue risk level")
+	result = values["averages_result"]
+	print(f"{prefix}averages recalculated for {result['recalculated']} parts, {result['skipped']} unchanged parts skipped")
+	result = values["airtable_result"]
+	print(f"{prefix}pushed {result['pushed']} records, skipped {result['skipped']} unchanged records, {result['failed']} failed")
+	print(f"{prefix}{client.stats['requests']} PartsBox requests, {client.stats['retries']} retried, {client.stats['errors']} connection errors")
+
+
 """main"""
 if __name__ == '__main__':
-	#get all parts data from PartsBox
-	url = "https://api.partsbox.com/api/1/part/all" 
-	json_cache = "request_cache.json"
+	parser = argparse.ArgumentParser(description = "calculate stock risk levels from PartsBox and push them to airtable")
+	parser.add_argument("--report", default = profiler.RUN_REPORT, help = "file the json run report is written to (each account of a multi account config writes its own report)")
+	parser.add_argument("--profile-stage", help = "name of a stage to run under cProfile")
+	parser.add_argument("--profile-file", help = "file the cProfile stats are dumped to, defaults to <stage>.prof")
+	parser.add_argument("--trace-memory", action = "store_true", help = "record peak memory of each stage with tracemalloc, stages then run one after another, slows down allocation heavy stages (never recorded for multi account configs)")
+	parser.add_argument("--workers", type = int, default = pipeline.WORKERS, help = "number of stages run at once, 1 runs them one after another")
+	parser.add_argument("--analytics-workers", type = int, default = 1, help = "number of processes used to recalculate averages")
+	parser.add_argument("--full-recalculation", action = "store_true", help = "recalculate the averages of every part, not only parts that changed")
+	parser.add_argument("--dry-run-lead-times", action = "store_true", help = "print the number of default lead times that would be written to PartsBox without writing them")
+	args = parser.parse_args()
 
 	try: 
 		with open("partsbox_config.json") as config_file: 
@@ -44,140 +336,65 @@ if __name__ == '__main__':
 		f.close
 		print("partsbox_config.json file created, populate file with your api key and rerun program!\n the format for the config file is as follows\n {'API_key': 'APIKey enter_your_api_key_here'}")
 
-	headers = {
-	"Authorization": config[READ]["API_key"],
-	"Content-Type" : "application/json" #get api key for read only access
-	}
-
-	#for testing timestamp function 
-	print("entering timestmap function")
-	Timestamps = time_stamp.get_timestamps()
-	print("after timestamp function")
-	cache_name = "request_cache.json"
-	timeframe = "week"
-
-	update = cache.get_update_flag(Timestamps[0], cache_name, timeframe)
-
-	#check rate limit for Partsbox api
-	sort_data.check_partsbox_limit()
-
-	data: dict = cache.fetch_data(update = update,
-						    json_cache = json_cache,
-							url = url, 
-							headers = headers,
-							params = None)
-
-	#create list of just the data entries from api response
-	parts = data["data"]
-
-
-	#for testing delete empty stock lists 
-	print("before delete function")
-	parts = sort_data.remove_empty_stock_list(parts)
-	#jprint(sorted_stock)
-	length = len(parts)
-	print("Length after inital delete", length)
-	print("after delete function")
-
-
-	#for testing lead time function 
-	print("entering update lead time functions")
-	#change header to api key for writing in order to update lead times if necessary 
-	headers = {
-			"Authorization": config[WRITE]["API_key"] 
-			}
-	sort_data.update_lead_times(parts, headers)
-	print("after update lead time function")
-
-
-	#for testing total stock function
-	print("entering total stock function")
-	parts = calculate.total_stock(parts)
-	#jprint(parts)
-	print("after stock function")
-
-
-	#for testing date of last restock function 
-	print("before get last restock function")
-	time_stamp.get_date_of_last_restock(Timestamps[0], parts)
-	#jprint(parts)
-	print("after get last restock function")
-
-
-	#for testing sort function
-	print("before sort function")
-	sorted_stock = sort_data.sort(parts, Timestamps)
-	#jprint(sorted_stock)
-	print("after sort function")
-
-
-	#for testing delete empty stock lists 
-	print("before delete function")
-	length = len(sorted_stock)
-	print("length before second delete", length)
-	sorted_stock = sort_data.remove_empty_stock_dict(sorted_stock)
-	#jprint(sorted_stock)
-	length = len(sorted_stock)
-	print("Length after second delete", length)
-	print("after delete function")
-
-
-	#for testing batch average function 
-	print("before batch avg function")
-	batch_averages = calculate.get_avg_batch(sorted_stock, Timestamps)
-	#jprint(batch_averages)
-	print("after batch avg function")
-
-
-	#for testing average time function 
-	print("before time average function")
-	sorted_stock = calculate.get_avg_time(sorted_stock, Timestamps)
-	#jprint(sorted_stock)
-	print("after time average function")
-
-
-	#for testing time since last batch function 
-	print("before time since function")
-	sorted_stock = time_stamp.get_time_since_last_batch(Timestamps[0], sorted_stock)
-	#jprint(sorted_stock)
-	print("after time since function")
-
-
-	#for testing risk level function 
-	print("before risk level function")
-	sorted_stock = calculate.get_risk_level(sorted_stock, Timestamps[0])
-	#jprint(sorted_stock)
-	print("after risk level function")
-
-	#for testing get projects function
-	print("before getting projects")
-	result = sort_data.get_projects(headers, Timestamps[0])
-	projects = result["projects"]
-	update = result["update"]
-	#jprint(projects)
-	print("after getting projects")
-
-	#for testing getting boms 
-	print("before getting boms")
-	project_boms = sort_data.get_boms(projects, headers, update)
-	#jprint(project_boms)
-	print("after getting boms")
-
-	#for testing the update project data 
-	print("before updating project data")
-	sorted_stock = sort_data.update_project_data(project_boms, sorted_stock)
-	#jprint(sorted_stock)
-	print("after updating project data")
-
-
-	#for testing the get data for airtable function
-	print("before getting data for airtable")
-	airtable_data = sort_data.get_data_for_airtable(sorted_stock)
-	print("after getting data for airtable")
-	#jprint(airtable_data) 
-
-
-	#for testing pushing to airtable
-	print("before pushing to airtable")
-	sort_data.push_to_airtable(airtable_data)
-	print("after pushing to airtable")
\ No newline at end of file
+	accounts = get_accounts(config)
+
+	if accounts[0]["name"] is None: 
+		#peak memory is traced process wide, stages run one after another so each stage gets its own peak and counters 
+		workers = 1 if args.trace_memory else args.workers
+		if workers > 1: 
+			print(f"running up to {workers} stages at once, requests, cache hits and misses are only reported for the whole run (--workers 1 reports them per stage)")
+		#every PartsBox request goes through one pooled client
+		client = partsbox.get_client()
+		#every stage is timed, results are written to the run report at the end
+		stages = profiler.StageProfiler(client = client,
+										profile_stage = args.profile_stage,
+										profile_name = args.profile_file,
+										trace_memory = args.trace_memory,
+										concurrent = workers > 1,
+										database = get_tenant(accounts[0])["database"])
+
+		values = run_account(accounts[0], client, stages, args.analytics_workers, args.full_recalculation, workers, args.dry_run_lead_times)
+		#jprint(values["sorted_stock"])
+
+		client.close()
+		print_summary(values, client)
+
+		stages.write_report(args.report)
+		stages.close()
+		print(f"run report written to {args.report}")
+	else: 
+		#accounts run at the same time, sharing one connection pool, each with its own PartsBox rate limit 
+		shared = partsbox.PartsBoxClient(pool_size = partsbox.POOL_SIZE * len(accounts))
+		sort_data.PROGRESS_BARS = False #bars of accounts running at once would draw over each other
+		runs = {}
+
+		with ThreadPoolExecutor(max_workers = len(accounts), thread_name_prefix = "account") as executor: 
+			for account in accounts: 
+				client = partsbox.PartsBoxClient(base_url = account.get("base_url", partsbox.BASE_URL), shared = shared)
+				tenant = get_tenant(account)
+				#memory is traced process wide, so peaks would include every account running at the same time 
+				stages = profiler.StageProfiler(client = client,
+												profile_stage = args.profile_stage,
+												profile_name = os.path.join(os.path.dirname(tenant["report"]), args.profile_file or f"{args.profile_stage}.prof"),
+												trace_memory = False,
+												concurrent = True,
+												database = tenant["database"])
+				future = executor.submit(run_tenant, account, client, stages, args.analytics_workers, args.full_recalculation, args.workers, args.dry_run_lead_times)
+				runs[account["name"]] = {"future": future, "client": client, "stages": stages, "report": tenant["report"]}
+
+		shared.close()
+		failed = []
+		for name, run in runs.items(): 
+			try: 
+				values = run["future"].result()
+			except Exception as e: 
+				print(f"[{name}] failed: {e!r}")
+				failed.append(name)
+				continue
+
+			print_summary(values, run["client"], name)
+			run["stages"].write_report(run["report"])
+			print(f"[{name}] run report written to {run['report']}")
+
+		if failed: 
+			raise SystemExit(f"{len(failed)} of {len(runs)} accounts failed: {', '.join(failed)}")
@@ -0,0 +1,398 @@
+"""
+Local stand-in for the PartsBox and Airtable apis, used for offline load testing.
+
+Serves part/all, project/all, project/get-entries and part/update-custom-fields from synthetic data (see synthetic_data)
+and accepts airtable upserts. Latency, jitter, injected rate limit (429) errors and per second limits can be set,
+so the concurrency, retry and rate limit behavior of every network path can be measured without a real account.
+
+point a run at the server with the PARTSBOX_BASE_URL and AIRTABLE_URL environment variables (see base_url and airtable_url)
+
+usage: python mock_server.py --parts 3000 [--latency 0.05] [--jitter 0.02] [--error-rate 0.05] [--partsbox-limit 10] [--airtable-limit 5]
+       python mock_server.py --parts 3000 --load-test (run every network path against the server and print throughput)
+
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import synthetic_data
+import time_stamp
+
+
+HOST = "127.0.0.1"
+PORT = 8080
+PARTSBOX_PATH = "/api/1/"
+AIRTABLE_PATH = "/v0/mock_base/mock_table"
+AIRTABLE_BATCH_SIZE = 10 #airtable rejects upserts with more records
+RETRY_AFTER = 1 #(seconds) sent with every 429 response
+
+
+class RequestLimit:
+	"""
+	Thread safe limit on the number of requests in any one second window.
+
+	@params
+		- limit: number of requests allowed per second, None for no limit
+	"""
+
+	def __init__(self, limit = None):
+		self.limit = limit
+		self.times = deque()
+		self.lock = threading.Lock()
+
+	def allow(self):
+		"""
+		Count a request if it is within the limit.
+
+		@params
+			- none
+		@returns
+			- allowed: bool, False if the request goes over the limit (it is not counted)
+		"""
+		if self.limit is None:
+			return True
+
+		with self.lock:
+			now = time.monotonic()
+			while self.times and self.times[0] <= now - 1:
+				self.times.popleft()
+			if len(self.times) >= self.limit:
+				return False
+			self.times.append(now)
+
+		return True
+
+
+class MockHandler(BaseHTTPRequestHandler):
+	"""
+	Request handler for MockServer, every endpoint is answered from the state of self.server.
+	"""
+
+	protocol_version = "HTTP/1.1" #keep connections alive like the real apis
+
+	def log_message(self, format, *args):
+		pass
+
+	def send_json(self, status, body, headers = None):
+		if not isinstance(body, bytes):
+			body = json.dumps(body).encode("utf-8")
+
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def read_json(self):
+		length = int(self.headers.get("Content-Length") or 0)
+		if not length:
+			return None
+
+		return json.loads(self.rfile.read(length))
+
+	def handle_request(self, method):
+		url = urlparse(self.path)
+		body = self.read_json() if method != "GET" else None
+		server = self.server
+
+		if url.path.startswith(PARTSBOX_PATH):
+			endpoint = url.path[len(PARTSBOX_PATH):]
+			limit = server.partsbox_limit
+		elif url.path == AIRTABLE_PATH:
+			endpoint = "airtable"
+			limit = server.airtable_limit
+		else:
+			self.send_json(404, {"error": f"unknown path {url.path}"})
+			return
+
+		route = server.routes.get((method, endpoint))
+		if route is None:
+			self.send_json(404, {"error": f"unknown endpoint {method} {endpoint}"})
+			return
+
+		server.count(endpoint, "requests")
+		server.wait()
+
+		#injected errors and limits are answered like the real apis, with a Retry-After header
+		if not limit.allow() or server.is_injected_error():
+			server.count(endpoint, "throttled")
+			self.send_json(429, {"error": "rate limited"}, {"Retry-After": str(server.retry_after)})
+			return
+
+		status, response = route(parse_qs(url.query), body)
+		if status >= 400:
+			server.count(endpoint, "errors")
+		self.send_json(status, response)
+
+	def do_GET(self):
+		self.handle_request("GET")
+
+	def do_POST(self):
+		self.handle_request("POST")
+
+	def do_PATCH(self):
+		self.handle_request("PATCH")
+
+
+class MockServer(ThreadingHTTPServer):
+	"""
+	Threaded http server standing in for PartsBox and Airtable.
+
+	usage:
+		with MockServer(synthetic_data.get_payloads(3000), latency = 0.05) as server:
+			client = partsbox.PartsBoxClient(base_url = server.base_url)
+
+	@params
+		- payloads: dictionary of endpoints to payloads, as returned by synthetic_data.get_payloads
+		- latency: time every response is delayed by (seconds)
+		- jitter: random extra delay of up to this many seconds
+		- error_rate: fraction of requests (0 to 1) answered with a 429 error
+		- partsbox_limit: number of PartsBox requests allowed per second, None for no limit
+		- airtable_limit: number of airtable requests allowed per second, None for no limit
+		- retry_after: value of the Retry-After header sent with 429 errors (seconds)
+		- host: address to listen on
+		- port: port to listen on, 0 picks a free port
+		- seed: seed for the random number generator used for jitter and injected errors
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, payloads, latency = 0, jitter = 0, error_rate = 0, partsbox_limit = None, airtable_limit = None,
+				 retry_after = RETRY_AFTER, host = HOST, port = PORT, seed = synthetic_data.SEED):
+		super().__init__((host, port), MockHandler)
+		self.payloads = payloads
+		self.latency = latency
+		self.jitter = jitter
+		self.error_rate = error_rate
+		self.partsbox_limit = RequestLimit(partsbox_limit)
+		self.airtable_limit = RequestLimit(airtable_limit)
+		self.retry_after = retry_after
+		self.random = random.Random(seed)
+
+		self.parts = {part["part/id"]: part for part in payloads["part/all"]["data"]}
+		self.part_body = None #encoded part/all response, cleared when a part changes
+		self.records = {} #airtable records by part_id
+		self.stats = {}
+		self.lock = threading.Lock()
+		self.thread = None
+
+		self.routes = {("GET", "part/all"): self.get_parts,
+					   ("GET", "project/all"): self.get_projects,
+					   ("GET", "project/get-entries"): self.get_project_entries,
+					   ("POST", "part/update-custom-fields"): self.update_custom_fields,
+					   ("PATCH", "airtable"): self.upsert_records}
+
+	@property
+	def base_url(self):
+		"""PartsBox base url of the server, for partsbox.PartsBoxClient or PARTSBOX_BASE_URL"""
+		return f"http://{self.server_address[0]}:{self.server_address[1]}{PARTSBOX_PATH}"
+
+	@property
+	def airtable_url(self):
+		"""airtable table url of the server, for AIRTABLE_URL or the URL of airtable_config.json"""
+		return f"http://{self.server_address[0]}:{self.server_address[1]}{AIRTABLE_PATH}"
+
+	def start(self):
+		"""
+		Serve requests in a background thread.
+
+		@params
+			- none
+		@returns
+			- server: this server
+		"""
+		self.thread = threading.Thread(target = self.serve_forever, name = "mock_server", daemon = True)
+		self.thread.start()
+
+		return self
+
+	def stop(self):
+		"""
+		Stop serving and close the socket.
+
+		@params
+			- none
+		@returns
+			- none
+		"""
+		if self.thread is not None:
+			self.shutdown()
+			self.thread.join()
+			self.thread = None
+		self.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exception):
+		self.stop()
+
+	def count(self, endpoint, stat):
+		with self.lock:
+			counts = self.stats.setdefault(endpoint, {"requests": 0, "throttled": 0, "errors": 0})
+			counts[stat] += 1
+
+	def wait(self):
+		"""Delay a response by the latency plus random jitter."""
+		with self.lock:
+			delay = self.latency + self.random.uniform(0, self.jitter)
+		if delay > 0:
+			time.sleep(delay)
+
+	def is_injected_error(self):
+		with self.lock:
+			return self.random.random() < self.error_rate
+
+	def get_parts(self, query, body):
+		with self.lock:
+			if self.part_body is None:
+				self.part_body = json.dumps({"data": list(self.parts.values())}).encode("utf-8")
+			part_body = self.part_body
+
+		return 200, part_body
+
+	def get_projects(self, query, body):
+		return 200, self.payloads["project/all"]
+
+	def get_project_entries(self, query, body):
+		project_id = query.get("project/id", [None])[0]
+		entries = self.payloads["project/get-entries"].get(project_id)
+		if entries is None:
+			return 404, {"error": f"unknown project {project_id}"}
+
+		return 200, entries
+
+	def update_custom_fields(self, query, body):
+		part_id = (body or {}).get("part/id")
+
+		with self.lock:
+			part = self.parts.get(part_id)
+			if part is None:
+				return 404, {"error": f"unknown part {part_id}"}
+
+			fields = {field["key"]: field for field in part.setdefault("part/custom-fields", [])}
+			for field in body.get("custom-fields", []):
+				if field["key"] in fields:
+					fields[field["key"]]["value"] = field["value"]
+				else:
+					part["part/custom-fields"].append(dict(field))
+			self.part_body = None
+
+		return 200, {"data": part}
+
+	def upsert_records(self, query, body):
+		records = (body or {}).get("records", [])
+		merge_on = (body or {}).get("performUpsert", {}).get("fieldsToMergeOn")
+		if not merge_on or not 0 < len(records) <= AIRTABLE_BATCH_SIZE:
+			return 422, {"error": f"expected performUpsert and 1 to {AIRTABLE_BATCH_SIZE} records"}
+
+		with self.lock:
+			for record in records:
+				self.records[record["fields"]["part_id"]] = record["fields"]
+
+		return 200, {"records": [{"id": record["fields"]["part_id"], "fields": record["fields"]} for record in records]}
+
+
+def run_load_test(server, workers = None):
+	"""
+	Run every network path against a mock server and measure its throughput.
+
+	Runs in a temporary directory so the cache database and sync ledger of the working directory are not touched.
+
+	@params
+		- server: running MockServer
+		- workers: optional number of requests kept in flight by each path, defaults to the setting of each path
+	@returns
+		- result: dictionary of path names to the time (seconds), number of requests, requests per second and
+		          the result of the path, plus the stats of the client and the server
+	"""
+	import cache
+	import partsbox
+	import sort_data
+
+	headers = {"Authorization": "APIKey mock"}
+	#effectively no client side limit, so the limits of the server are what is measured
+	client = partsbox.PartsBoxClient(base_url = server.base_url, calls = 1000000, period = 1)
+	worker_kwargs = {} if workers is None else {"workers": workers}
+	result = {}
+
+	def measure(name, function):
+		requests_before = sum(counts["requests"] for counts in server.stats.values())
+		start = time.perf_counter()
+		output = function()
+		seconds = time.perf_counter() - start
+		requests = sum(counts["requests"] for counts in server.stats.values()) - requests_before
+		result[name] = {"seconds": seconds, "requests": requests, "requests_per_second": requests / max(seconds, 1e-9)}
+		print(f"{name:<20}{seconds:>10.3f}s {requests:>7} requests {requests / max(seconds, 1e-9):>9.1f}/s")
+
+		return output
+
+	directory = os.getcwd()
+	airtable_url = os.environ.get("AIRTABLE_URL")
+	os.environ["AIRTABLE_URL"] = server.airtable_url
+	try:
+		with tempfile.TemporaryDirectory() as temporary_directory, client:
+			os.chdir(temporary_directory)
+
+			parts = measure("fetch_data", lambda: cache.fetch_data(update = True, json_cache = "request_cache.json", url = client.get_url("part/all"),
+																	  headers = headers, params = None, client = client)["data"])
+			result["update_lead_times"] = measure("update_lead_times", lambda: sort_data.update_lead_times(parts, headers, client = client, **worker_kwargs))
+			projects = sort_data.get_projects(headers, time_stamp.get_timestamps()[0], client = client)["projects"]
+			measure("get_boms", lambda: sort_data.get_boms(projects, headers, client = client, **worker_kwargs))
+
+			records = [{"fields": {"part_id": part["part/id"], "description": part.get("part/description", "")}} for part in parts]
+			result["push_to_airtable"] = measure("push_to_airtable", lambda: sort_data.push_to_airtable(records, full_sync = True, **worker_kwargs))
+	finally:
+		os.chdir(directory)
+		if airtable_url is None:
+			os.environ.pop("AIRTABLE_URL", None)
+		else:
+			os.environ["AIRTABLE_URL"] = airtable_url
+
+	result["client"] = dict(client.stats)
+	result["server"] = server.stats
+
+	return result
+
+
+"""main"""
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "serve synthetic PartsBox and airtable apis locally")
+	parser.add_argument("--parts", type = int, default = synthetic_data.SIZES["small"], help = "number of parts in the synthetic inventory")
+	parser.add_argument("--entries", type = int, default = synthetic_data.ENTRIES_PER_PART, help = "average number of stock entries per part")
+	parser.add_argument("--seed", type = int, default = synthetic_data.SEED)
+	parser.add_argument("--host", default = HOST)
+	parser.add_argument("--port", type = int, default = PORT, help = "port to listen on, 0 picks a free port")
+	parser.add_argument("--latency", type = float, default = 0, help = "delay added to every response (seconds)")
+	parser.add_argument("--jitter", type = float, default = 0, help = "random extra delay of up to this many seconds")
+	parser.add_argument("--error-rate", type = float, default = 0, help = "fraction of requests answered with a 429 error")
+	parser.add_argument("--partsbox-limit", type = int, help = "PartsBox requests allowed per second")
+	parser.add_argument("--airtable-limit", type = int, help = "airtable requests allowed per second")
+	parser.add_argument("--load-test", action = "store_true", help = "run every network path against the server and exit")
+	parser.add_argument("--workers", type = int, help = "requests kept in flight by each path during the load test")
+	args = parser.parse_args()
+
+	payloads = synthetic_data.get_payloads(args.parts, args.entries, seed = args.seed, current_timestamp = time_stamp.get_timestamps()[0])
+	server = MockServer(payloads, args.latency, args.jitter, args.error_rate, args.partsbox_limit, args.airtable_limit,
+						host = args.host, port = args.port, seed = args.seed)
+
+	with server:
+		if args.load_test:
+			result = run_load_test(server, args.workers)
+			print(json.dumps({"client": result["client"], "server": result["server"]}, indent = 4))
+			raise SystemExit(0)
+
+		print(f"serving {args.parts} parts, use\n  PARTSBOX_BASE_URL={server.base_url}\n  AIRTABLE_URL={server.airtable_url}")
+		try:
+			server.thread.join()
+		except KeyboardInterrupt:
+			pass
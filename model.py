@@ -0,0 +1,267 @@
+"""
+Module containing a compact in memory representation of sorted part data.
+
+A part's stock history is stored as array('q') columns of timestamps and quantities with a flag byte per entry,
+instead of one dictionary per entry, and each part is a __slots__ object instead of a dictionary.
+Both support the same key access as the dictionary form, so the functions in calculate, time_stamp and sort_data run on them unchanged.
+
+"""
+
+import json
+import tracemalloc
+from array import array
+
+
+#flag bits for each stock entry
+MOVED = 1 #comment contains "moved", entry is neither a batch nor a restock
+BATCH = 2 #negative quantity that is not a move (consumption by production)
+
+#keys of the dictionary form and the attribute each is stored in
+FIELDS = {"description": "description",
+		  "mpn": "mpn",
+		  "total_stock": "total_stock",
+		  "part/restock": "restock",
+		  "lead_time_(weeks)": "lead_time",
+		  "projects_used_in": "projects_used_in",
+		  "stock": "stock",
+		  "batch/averages": "batch_averages",
+		  "batch/average_for_calculations": "batch_average",
+		  "time/averages": "time_averages",
+		  "time/average_for_calculations": "time_average",
+		  "days_since_last_batch": "days_since_last_batch",
+		  "date_last_batch": "date_last_batch",
+		  "risk_level": "risk_level",
+		  "estimated_rop": "estimated_rop"}
+
+
+class StockEntry:
+	"""
+	View of a single entry in a StockHistory, supporting the keys of a stock entry dictionary.
+
+	"stock/comments" is only available for moved entries, as "moved", other comments are not stored.
+
+	@params
+		- history: StockHistory the entry belongs to
+		- index: position of the entry in the history
+	"""
+
+	__slots__ = ("history", "index")
+
+	def __init__(self, history, index):
+		self.history = history
+		self.index = index
+
+	def __getitem__(self, key):
+		if key == "stock/timestamp":
+			return self.history.timestamps[self.index]
+		if key == "stock/quantity":
+			return self.history.quantities[self.index]
+		if key == "stock/comments" and self.history.flags[self.index] & MOVED:
+			return "moved"
+
+		raise KeyError(key)
+
+	def get(self, key, default = None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+
+class StockHistory:
+	"""
+	Stock history of a part stored as columns.
+
+	@params
+		- timestamps: array('q') of unix timestamps, in milliseconds
+		- quantities: array('q') of quantities
+		- flags: bytearray of MOVED/BATCH flags
+	"""
+
+	__slots__ = ("timestamps", "quantities", "flags")
+
+	def __init__(self, timestamps = None, quantities = None, flags = None):
+		self.timestamps = array("q") if timestamps is None else timestamps
+		self.quantities = array("q") if quantities is None else quantities
+		self.flags = bytearray() if flags is None else flags
+
+	@classmethod
+	def from_entries(cls, entries):
+		"""
+		Build a stock history from a list of stock entry dictionaries.
+
+		@params
+			- entries: list of stock entries from api response/cache or sorted data
+		@returns
+			- history: StockHistory with the same timestamps and quantities, and flags set from the comments and quantities
+		"""
+		history = cls()
+
+		for stock in entries:
+			quantity = stock["stock/quantity"]
+			comment = stock.get("stock/comments")
+			flag = MOVED if comment is not None and "moved" in comment.lower() else 0
+			if not flag and quantity < 0:
+				flag = BATCH
+
+			history.timestamps.append(stock["stock/timestamp"])
+			history.quantities.append(quantity)
+			history.flags.append(flag)
+
+		return history
+
+	def __len__(self):
+		return len(self.timestamps)
+
+	def __getitem__(self, index):
+		if index < 0:
+			index = index + len(self.timestamps)
+		if not 0 <= index < len(self.timestamps):
+			raise IndexError("stock history index out of range")
+
+		return StockEntry(self, index)
+
+	def __iter__(self):
+		for index in range(len(self.timestamps)):
+			yield StockEntry(self, index)
+
+	def to_list(self):
+		"""
+		Convert back to a list of stock entry dictionaries (for printing or json).
+
+		@params
+			- none
+		@returns
+			- entries: list of dictionaries with stock/timestamp, stock/quantity, and stock/comments for moved entries
+		"""
+		entries = []
+		for index in range(len(self.timestamps)):
+			stock = {"stock/timestamp": self.timestamps[index], "stock/quantity": self.quantities[index]}
+			if self.flags[index] & MOVED:
+				stock["stock/comments"] = "moved"
+			entries.append(stock)
+
+		return entries
+
+
+class Part:
+	"""
+	Sorted data for a single part, supporting the keys of the dictionary form (see FIELDS).
+
+	Unset fields raise KeyError, the same as a missing dictionary key.
+	"""
+
+	__slots__ = tuple(FIELDS.values())
+
+	@classmethod
+	def from_dict(cls, data):
+		"""
+		Build a part from the dictionary form, the stock list is converted to a StockHistory.
+
+		@params
+			- data: dictionary for a single part in sorted_stock
+		@returns
+			- part: Part with the same fields
+		"""
+		part = cls()
+
+		for key, value in data.items():
+			if key == "stock" and not isinstance(value, StockHistory):
+				value = StockHistory.from_entries(value)
+			part[key] = value
+
+		return part
+
+	def __getitem__(self, key):
+		try:
+			return getattr(self, FIELDS[key])
+		except AttributeError:
+			raise KeyError(key) from None
+
+	def __setitem__(self, key, value):
+		setattr(self, FIELDS[key], value)
+
+	def __contains__(self, key):
+		return key in FIELDS and hasattr(self, FIELDS[key])
+
+	def keys(self):
+		return [key for key in FIELDS if hasattr(self, FIELDS[key])]
+
+	def get(self, key, default = None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def to_dict(self):
+		"""
+		Convert back to the dictionary form (for printing or json).
+
+		@params
+			- none
+		@returns
+			- data: dictionary for a single part in sorted_stock
+		"""
+		data = {key: self[key] for key in self.keys()}
+		if isinstance(data.get("stock"), StockHistory):
+			data["stock"] = data["stock"].to_list()
+
+		return data
+
+
+def compact_stock(sorted_stock):
+	"""
+	Convert sorted data to the compact representation.
+
+	@params
+		- sorted_stock: nested dictionary containg data for all valid parts
+	@returns
+		- compact_stock: dictionary of part ids to Part
+	"""
+	return {part: Part.from_dict(sorted_stock[part]) for part in sorted_stock}
+
+
+def measure_memory(build):
+	"""
+	Measure the memory allocated by a data structure while it is built.
+
+	@params
+		- build: function with no arguments that builds and returns the data structure
+	@returns
+		- result: dictionary with the data structure and the bytes still allocated once it has been built
+	"""
+	already_tracing = tracemalloc.is_tracing()
+	if not already_tracing:
+		tracemalloc.start()
+
+	before = tracemalloc.get_traced_memory()[0]
+	data = build()
+	allocated = tracemalloc.get_traced_memory()[0] - before
+
+	if not already_tracing:
+		tracemalloc.stop()
+
+	result = {"data": data, "bytes": allocated}
+
+	return result
+
+
+def compare_memory(sorted_stock):
+	"""
+	Compare the memory used by the dictionary and the compact representation of sorted data.
+
+	@params
+		- sorted_stock: nested dictionary containg data for all valid parts
+	@returns
+		- result: dictionary with bytes used by the dictionary form, the compact form, and the ratio between them
+	"""
+	#both forms are built from fresh copies so neither shares objects with sorted_stock
+	text = json.dumps(sorted_stock, default = str)
+	dict_form = measure_memory(lambda: json.loads(text))
+	compact_form = measure_memory(lambda: compact_stock(json.loads(text)))
+
+	result = {"dict_bytes": dict_form["bytes"],
+			  "compact_bytes": compact_form["bytes"],
+			  "ratio": dict_form["bytes"] / max(compact_form["bytes"], 1)}
+
+	return result
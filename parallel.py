@@ -0,0 +1,156 @@
+"""
+Module that runs the per part analytics (averages, time since last batch and risk level) across processes.
+
+sorted_stock is split into shards by part id, each worker process gets a compact shard with only the fields the
+analytics need (stock history as packed int64 columns) and sends back only the computed fields, which are merged into sorted_stock.
+
+"""
+
+import importlib
+import multiprocessing
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import model
+import ranking
+import time_stamp
+
+
+WORKERS = os.cpu_count() or 1
+ENGINES = ("calculate", "columnar") #modules that can be used for the averages and risk level
+#workers are started fresh instead of forked, forking while other pipeline stages hold locks in threads can deadlock
+START_METHOD = "spawn"
+SHARDS_PER_WORKER = 4 #more shards than workers keeps every worker busy when shards take different times
+#fields added to each part by the analytics
+RESULT_FIELDS = ("batch/averages", "batch/average_for_calculations", "time/averages", "time/average_for_calculations",
+				 "days_since_last_batch", "date_last_batch", "risk_level", "estimated_rop")
+
+
+def get_shards(sorted_stock, number_of_shards):
+	"""
+	Split sorted data into compact shards.
+
+	Parts are assigned to shards in order of part id, shards are cut so each has about the same number of stock entries.
+
+	@params
+		- sorted_stock: nested dictionary containg data for all valid parts
+		- number_of_shards: number of shards to make (fewer are made if there are fewer parts)
+	@returns
+		- shards: list of dictionaries containing
+			- part_ids: list of part ids in the shard
+			- offsets: array('q'), stock entries for part i are at [offsets[i], offsets[i + 1])
+			- timestamps: bytes of an array('q') of stock timestamps
+			- quantities: bytes of an array('q') of stock quantities
+			- lead_times: list of lead times (weeks)
+			- total_stock: list of total stock counts
+	"""
+	part_ids = sorted(sorted_stock)
+	total_entries = sum(len(sorted_stock[part]["stock"]) for part in part_ids)
+	entries_per_shard = max(1, -(-total_entries // max(1, number_of_shards)))
+
+	shards = []
+	shard = None
+	for part in part_ids:
+		if shard is None or shard["offsets"][-1] >= entries_per_shard:
+			shard = {"part_ids": [], "offsets": array("q", [0]), "timestamps": array("q"), "quantities": array("q"),
+					 "lead_times": [], "total_stock": []}
+			shards.append(shard)
+
+		history = sorted_stock[part]["stock"]
+		if isinstance(history, model.StockHistory):
+			shard["timestamps"].extend(history.timestamps)
+			shard["quantities"].extend(history.quantities)
+		else:
+			shard["timestamps"].extend(stock["stock/timestamp"] for stock in history)
+			shard["quantities"].extend(stock["stock/quantity"] for stock in history)
+
+		shard["part_ids"].append(part)
+		shard["offsets"].append(len(shard["timestamps"]))
+		shard["lead_times"].append(sorted_stock[part]["lead_time_(weeks)"])
+		shard["total_stock"].append(sorted_stock[part]["total_stock"])
+
+	#packed bytes pickle much smaller and faster than lists of integers
+	for shard in shards:
+		shard["timestamps"] = shard["timestamps"].tobytes()
+		shard["quantities"] = shard["quantities"].tobytes()
+
+	return shards
+
+
+def analyze_shard(shard, Timestamps, windows = None, engine = "calculate"):
+	"""
+	Run the analytics on one shard (called in a worker process).
+
+	@params
+		- shard: dictionary from get_shards
+		- Timestamps: dictionary of timestamps for the time periods used and the current timestamp
+		- windows: optional time_stamp.TimeWindows to use other time periods
+		- engine: name of the module used for the averages and risk level (see ENGINES)
+	@returns
+		- results: dictionary of part ids to dictionaries of the RESULT_FIELDS
+	"""
+	analytics = importlib.import_module(engine)
+	timestamps = array("q")
+	timestamps.frombytes(shard["timestamps"])
+	quantities = array("q")
+	quantities.frombytes(shard["quantities"])
+	offsets = shard["offsets"]
+
+	sorted_stock = {}
+	for part_index, part in enumerate(shard["part_ids"]):
+		start = offsets[part_index]
+		end = offsets[part_index + 1]
+		#sorted data only holds batches
+		history = model.StockHistory(timestamps[start:end], quantities[start:end], bytearray([model.BATCH]) * (end - start))
+		sorted_stock[part] = model.Part.from_dict({"total_stock": shard["total_stock"][part_index],
+												   "lead_time_(weeks)": shard["lead_times"][part_index],
+												   "stock": history})
+
+	sorted_stock = analytics.get_avg_batch(sorted_stock, Timestamps, windows = windows)
+	sorted_stock = analytics.get_avg_time(sorted_stock, Timestamps, windows = windows)
+	sorted_stock = time_stamp.get_time_since_last_batch(Timestamps[0], sorted_stock)
+	sorted_stock = analytics.get_risk_level(sorted_stock, Timestamps[0])
+
+	results = {part: {field: sorted_stock[part][field] for field in RESULT_FIELDS} for part in sorted_stock}
+
+	return results
+
+
+def get_analytics(sorted_stock, Timestamps, workers = WORKERS, windows = None, engine = "calculate", index = None):
+	"""
+	Calculate batch averages, time averages, time since last batch and risk level for every part, across processes.
+
+	Gives the same result as running calculate.get_avg_batch, calculate.get_avg_time,
+	time_stamp.get_time_since_last_batch and calculate.get_risk_level in order.
+
+	@params
+		- sorted_stock: nested dictionary containg data for all valid parts
+		- Timestamps: dictionary of timestamps for the time periods used and the current timestamp
+		- workers: number of worker processes, 1 runs the analytics in this process on a single shard
+		- windows: optional time_stamp.TimeWindows to use other time periods
+		- engine: name of the module used for the averages and risk level (see ENGINES)
+		- index: optional dictionary, filled with ranked indexes of every part once the results are merged (see ranking.build_index)
+	@returns
+		- sorted_stock: sorted data with the RESULT_FIELDS added to every part
+	"""
+	if engine not in ENGINES:
+		raise ValueError(f"unknown analytics engine {engine}, expected one of {ENGINES}")
+
+	if workers <= 1:
+		shard_results = [analyze_shard(shard, Timestamps, windows, engine) for shard in get_shards(sorted_stock, 1)]
+	else:
+		shards = get_shards(sorted_stock, workers * SHARDS_PER_WORKER)
+		with ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context(START_METHOD)) as executor:
+			shard_results = list(executor.map(analyze_shard, shards, [Timestamps] * len(shards),
+											  [windows] * len(shards), [engine] * len(shards)))
+
+	#merge the computed fields back into sorted_stock
+	for results in shard_results:
+		for part, fields in results.items():
+			for field, value in fields.items():
+				sorted_stock[part][field] = value
+
+	if index is not None: 
+		ranking.build_index(sorted_stock, index)
+
+	return sorted_stock
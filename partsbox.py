@@ -0,0 +1,189 @@
+"""
+Module containing the shared PartsBox api client.
+
+Every request to PartsBox goes through one pooled keep-alive session with gzip, timeouts,
+retries with backoff and the PartsBox rate limit built in.
+
+"""
+
+import os
+import threading
+import time
+import rate_limit
+
+
+#set PARTSBOX_BASE_URL to point every request at another server (e.g. mock_server)
+BASE_URL = os.environ.get("PARTSBOX_BASE_URL", "https://api.partsbox.com/api/1/")
+REQUESTS = 200 #partsbox lists a limit of 200 requests per minute
+TIME_PERIOD = 60 #(seconds)
+POOL_SIZE = 16 #connections kept alive, should be at least the number of workers making requests
+CONNECT_TIMEOUT = 10 #(seconds)
+READ_TIMEOUT = 120 #(seconds), part/all can take a while to be generated
+ATTEMPTS = 4 #attempts per request before giving up
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class PartsBoxClient:
+	"""
+	Pooled PartsBox api client, safe to share between threads.
+
+	@params
+		- base_url: url that endpoints are relative to
+		- calls: number of calls (integer) that can take place during one period
+		- period: time period (seconds)
+		- pool_size: number of connections kept alive
+		- timeout: (connect, read) timeout in seconds for every request
+		- attempts: attempts per request, connection errors, timeouts and RETRY_STATUSES are retried with backoff
+		- shared: optional PartsBoxClient whose connection pool is used instead of a new one (pool_size is then ignored),
+		          each client keeps its own rate limit and counters, e.g. one client per account
+	"""
+
+	def __init__(self, base_url = BASE_URL, calls = REQUESTS, period = TIME_PERIOD, pool_size = POOL_SIZE,
+				 timeout = (CONNECT_TIMEOUT, READ_TIMEOUT), attempts = ATTEMPTS, shared = None):
+		self.base_url = base_url
+		self.shared = shared
+		self.timeout = timeout
+		self.attempts = attempts
+		#capacity of 1 spaces requests evenly so no window of period goes over calls (a full bucket would add a burst of calls)
+		self.bucket = rate_limit.TokenBucket(calls = calls, period = period, capacity = 1)
+
+		self.pool_size = pool_size
+		#session is created by the first request, so runs served from the cache never import requests
+		self.session = None
+
+		#counters for the current process
+		self.stats = {"requests": 0, "retries": 0, "errors": 0}
+		self.lock = threading.Lock()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+
+	def close(self):
+		"""
+		Close every pooled connection, a shared pool is left open for the client that owns it.
+
+		@params
+			- none
+		@returns
+			- none
+		"""
+		if self.session is not None and self.shared is None:
+			self.session.close()
+
+	def get_session(self):
+		"""
+		Get the pooled session, creating it on first use.
+
+		@params
+			- none
+		@returns
+			- session: requests session shared by every request of this client
+		"""
+		if self.shared is not None:
+			return self.shared.get_session()
+
+		with self.lock:
+			if self.session is None:
+				import requests
+				from requests.adapters import HTTPAdapter
+
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = self.pool_size)
+				session.mount("https://", adapter)
+				session.mount("http://", adapter)
+				session.headers.update({"Accept-Encoding": "gzip, deflate", "Content-Type": "application/json"})
+				self.session = session
+
+		return self.session
+
+	def get_url(self, endpoint):
+		"""
+		Get the full url of an endpoint.
+
+		@params
+			- endpoint: endpoint relative to base_url (e.g. "part/all") or a full url
+		@returns
+			- url: full url
+		"""
+		if endpoint.startswith(("http://", "https://")):
+			return endpoint
+
+		return self.base_url + endpoint
+
+	def count(self, stat):
+		with self.lock:
+			self.stats[stat] += 1
+
+	def request(self, method, endpoint, *, headers = None, params = None, json = None, stream = False):
+		"""
+		Make a request, waiting for the rate limit and retrying failures with backoff.
+
+		@params
+			- method: http method (e.g. "GET")
+			- endpoint: endpoint relative to base_url or a full url
+			- headers: headers for api request, including authorization/api key
+			- params: optional query parameters
+			- json: optional json body
+			- stream: bool flag (set to true to read the body as a stream)
+		@returns
+			- response: requests response, the last one received if every attempt was retried
+		"""
+		import requests
+
+		session = self.get_session()
+		url = self.get_url(endpoint)
+		attempt = 0
+
+		while True:
+			attempt += 1
+			self.bucket.acquire()
+			self.count("requests")
+
+			try:
+				response = session.request(method, url, headers = headers, params = params, json = json,
+										   stream = stream, timeout = self.timeout)
+			except (requests.ConnectionError, requests.Timeout) as e:
+				self.count("errors")
+				if attempt >= self.attempts:
+					e.add_note(f"{method} {url} failed after {attempt} attempts")
+					raise
+				retry_after = None
+			else:
+				if response.status_code not in RETRY_STATUSES or attempt >= self.attempts:
+					return response
+				retry_after = response.headers.get("Retry-After")
+				response.close()
+
+			self.count("retries")
+			time.sleep(rate_limit.get_backoff(attempt, retry_after))
+
+	def get(self, endpoint, **kwargs):
+		return self.request("GET", endpoint, **kwargs)
+
+	def post(self, endpoint, **kwargs):
+		return self.request("POST", endpoint, **kwargs)
+
+
+DEFAULT_CLIENT = None
+DEFAULT_CLIENT_LOCK = threading.Lock()
+
+
+def get_client():
+	"""
+	Get the client shared by every module, creating it on first use.
+
+	@params
+		- none
+	@returns
+		- client: PartsBoxClient
+	"""
+	global DEFAULT_CLIENT
+
+	with DEFAULT_CLIENT_LOCK:
+		if DEFAULT_CLIENT is None:
+			DEFAULT_CLIENT = PartsBoxClient()
+
+	return DEFAULT_CLIENT
@@ -0,0 +1,142 @@
+"""
+Module that contains a dependency aware pipeline runner.
+
+Each stage declares the values it needs and the values it produces, a stage is started as soon as all of its inputs exist,
+so independent stages (such as the project/bom crawl and the stock analytics) run at the same time.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import nullcontext
+
+
+WORKERS = 4 #number of stages that can run at once
+
+
+class Stage:
+	"""
+	Single step of a pipeline.
+
+	@params
+		- name: name of the stage, used in the run report
+		- function: called with the values of inputs as positional arguments, in order
+		- inputs: names of the values the stage needs
+		- outputs: names of the values the stage produces, function returns a single value for one output and a tuple for more
+		- items: optional function giving the number of items processed from the first output (e.g. len for a dictionary of parts),
+		         by default the length of the first output is used if it is a list, tuple or set
+	"""
+
+	def __init__(self, name, function, inputs = (), outputs = (), items = None):
+		self.name = name
+		self.function = function
+		self.inputs = tuple(inputs)
+		self.outputs = tuple(outputs)
+		self.items = items
+
+	def __repr__(self):
+		return f"Stage({self.name!r}, inputs = {self.inputs}, outputs = {self.outputs})"
+
+
+def check_stages(stages, values):
+	"""
+	Check every input of every stage can be produced, and no value is produced twice.
+
+	@params
+		- stages: list of Stage
+		- values: names of the values available before any stage runs
+	@returns
+		- none, raises ValueError if the stages can not all be run
+	"""
+	producers = dict.fromkeys(values, None)
+	for stage in stages:
+		for output in stage.outputs:
+			if output in producers:
+				raise ValueError(f"{output} is produced by both {producers[output] or 'the initial values'} and {stage.name}")
+			producers[output] = stage.name
+
+	#walk the stages in dependency order, anything left over is missing an input or part of a cycle
+	available = set(values)
+	remaining = list(stages)
+	while remaining:
+		ready = [stage for stage in remaining if available.issuperset(stage.inputs)]
+		if not ready:
+			missing = {stage.name: sorted(set(stage.inputs) - available) for stage in remaining}
+			raise ValueError(f"stages can not be run, waiting on inputs that are never produced: {missing}")
+		for stage in ready:
+			available.update(stage.outputs)
+			remaining.remove(stage)
+
+
+def run_stage(stage, arguments, profiler):
+	"""
+	Run a single stage, measured by profiler if one is given.
+
+	@params
+		- stage: Stage to run
+		- arguments: list of the values of the inputs of stage
+		- profiler: optional profiler.StageProfiler
+	@returns
+		- outputs: dictionary of output names to values
+	"""
+	measure = nullcontext({}) if profiler is None else profiler.stage(stage.name)
+
+	with measure as measurement:
+		result = stage.function(*arguments)
+
+		if len(stage.outputs) == 1:
+			result = (result,)
+		elif not stage.outputs:
+			result = ()
+		outputs = dict(zip(stage.outputs, result, strict = True))
+
+		#number of items in the first output, dictionaries are only counted by stages that say how (a result dictionary is not a collection)
+		if stage.items is not None:
+			measurement["items"] = stage.items(result[0])
+		elif stage.outputs and isinstance(result[0], (list, tuple, set)):
+			measurement["items"] = len(result[0])
+
+	return outputs
+
+
+def run(stages, values = None, workers = WORKERS, profiler = None):
+	"""
+	Run stages in dependency order, overlapping stages that do not depend on each other.
+
+	Stages run in threads, so overlapping helps when one path waits on the network while the other uses the cpu.
+	Stages that share a mutable value must be chained through their outputs so they never run at the same time.
+	With a profiler, cpu time and peak memory are process wide, so they include any stage running at the same time.
+	When a stage raises, no new stages are started and the exception is raised once running stages finish.
+
+	@params
+		- stages: list of Stage
+		- values: optional dictionary of values available before any stage runs
+		- workers: number of stages that can run at once (1 runs the stages one after another)
+		- profiler: optional profiler.StageProfiler, every stage is measured by it
+	@returns
+		- values: dictionary of every initial value and every stage output
+	"""
+	values = dict(values or {})
+	check_stages(stages, values)
+
+	remaining = list(stages)
+	running = {}
+
+	with ThreadPoolExecutor(max_workers = workers) as executor:
+		while remaining or running:
+			#start every stage whose inputs are all available
+			for stage in [stage for stage in remaining if all(name in values for name in stage.inputs)]:
+				remaining.remove(stage)
+				arguments = [values[name] for name in stage.inputs]
+				running[executor.submit(run_stage, stage, arguments, profiler)] = stage
+
+			done, pending = wait(running, return_when = FIRST_COMPLETED)
+			for future in done:
+				stage = running.pop(future)
+				try:
+					values.update(future.result())
+				except BaseException as e:
+					e.add_note(f"pipeline stage {stage.name} failed")
+					wait(running)
+					raise
+
+	return values
@@ -0,0 +1,219 @@
+"""
+Module that contains the stage profiler used to instrument each step of the partsbox api interface.
+
+Every stage records wall time, cpu time, peak allocated memory, item count, PartsBox requests and cache hits,
+the results are written to a json run report. One stage can also be profiled with cProfile.
+
+The request and cache counters, cpu time and traced memory are shared by the whole process, so when stages overlap
+(pipeline.run with more than one worker, or accounts run at once) a stage would also count the work of the stages
+running beside it. A concurrent profiler only records the cpu time of the thread running each stage and leaves the
+other measurements to the totals of the run.
+
+"""
+
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+import cache
+
+
+RUN_REPORT = "run_report.json"
+
+
+class StageProfiler:
+	"""
+	Records measurements for each stage of a run.
+
+	usage:
+		with profiler.stage("scan_stock") as stage:
+			sorted_stock = sort_data.scan_stock(parts)
+			stage["items"] = len(sorted_stock)
+
+	@params
+		- client: optional partsbox.PartsBoxClient, its request counter is used for the number of http calls of each stage
+		- profile_stage: optional name of a stage to run under cProfile
+		- profile_name: file the cProfile stats are dumped to, defaults to <stage name>.prof
+		- trace_memory: bool flag (set to true to record peak memory with tracemalloc, which slows down allocation heavy stages)
+		- concurrent: bool flag (set to true when stages overlap, requests, cache counters and memory are then only reported for the whole run)
+		- database: file name of the SQLite cache database whose hits and misses are counted
+		- quiet: bool flag (set to true to only record the stages, without printing a line for each)
+	"""
+
+	def __init__(self, client = None, profile_stage = None, profile_name = None, trace_memory = False, concurrent = False, database = cache.CACHE_DATABASE, quiet = False):
+		self.client = client
+		self.database = database
+		self.quiet = quiet
+		self.profile_stage = profile_stage
+		self.profile_name = profile_name
+		self.trace_memory = trace_memory
+		self.concurrent = concurrent
+		self.stages = []
+		self.started = time.time()
+		self.start = time.perf_counter()
+
+		#only stop tracing on close if this profiler started it
+		self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+		if self.started_tracing:
+			tracemalloc.start()
+
+	def get_counters(self):
+		"""
+		Get the current request and cache counters.
+
+		@params
+			- none
+		@returns
+			- counters: dictionary of http requests, cache hits and cache misses so far
+		"""
+		cache_stats = cache.get_cache_stats(self.database)
+		counters = {"http_requests": 0 if self.client is None else self.client.stats["requests"],
+					"cache_hits": cache_stats["hits"],
+					"cache_misses": cache_stats["misses"]}
+
+		return counters
+
+	@contextmanager
+	def stage(self, name):
+		"""
+		Measure a stage, the measurements are added to the report when the stage ends (even if it raises).
+
+		@params
+			- name: name of the stage
+		@returns
+			- stage: dictionary of measurements for the stage, set stage["items"] to record the number of items processed
+		"""
+		stage = {"name": name, "items": None}
+		counters = self.get_counters()
+		#thread_time leaves out work done in other threads or processes, but never counts the stages running beside this one
+		cpu_time = time.thread_time if self.concurrent else time.process_time
+		#resetting the peak would also reset it for the stages that are still running
+		trace_memory = self.trace_memory and not self.concurrent
+
+		profile = None
+		if name == self.profile_stage:
+			import cProfile
+
+			profile = cProfile.Profile()
+
+		if trace_memory:
+			tracemalloc.reset_peak()
+			memory_before = tracemalloc.get_traced_memory()[0]
+
+		wall_start = time.perf_counter()
+		cpu_start = cpu_time()
+		if profile is not None:
+			profile.enable()
+
+		try:
+			yield stage
+		except BaseException as e:
+			stage["error"] = repr(e)
+			raise
+		finally:
+			if profile is not None:
+				profile.disable()
+			stage["wall_seconds"] = time.perf_counter() - wall_start
+			stage["cpu_seconds"] = cpu_time() - cpu_start
+
+			if trace_memory:
+				stage["peak_bytes"] = max(0, tracemalloc.get_traced_memory()[1] - memory_before)
+			else:
+				stage["peak_bytes"] = None
+
+			for counter, value in self.get_counters().items():
+				stage[counter] = None if self.concurrent else value - counters[counter]
+
+			if profile is not None:
+				stage["profile"] = self.profile_name or f"{name}.prof"
+				profile.dump_stats(stage["profile"])
+
+			self.stages.append(stage)
+			if not self.quiet:
+				print(self.format_stage(stage))
+
+	def format_stage(self, stage):
+		"""
+		Format the measurements of a stage as a single line.
+
+		@params
+			- stage: dictionary of measurements for the stage
+		@returns
+			- line: string summary of the stage
+		"""
+		line = f"{stage['name']}: {stage['wall_seconds']:.3f}s wall, {stage['cpu_seconds']:.3f}s cpu"
+		if "error" in stage:
+			line = line + f", failed with {stage['error']}"
+		if stage["peak_bytes"] is not None:
+			line = line + f", {stage['peak_bytes'] / 1e6:.1f} MB peak"
+		if stage["items"] is not None:
+			line = line + f", {stage['items']} items"
+		if stage["http_requests"]:
+			line = line + f", {stage['http_requests']} requests"
+		if stage["cache_hits"] or stage["cache_misses"]:
+			line = line + f", {stage['cache_hits']} cache hits, {stage['cache_misses']} misses"
+
+		return line
+
+	def get_report(self):
+		"""
+		Get the run report.
+
+		@params
+			- none
+		@returns
+			- report: dictionary with the start time, total wall time, how the counters are attributed (per stage or whole run),
+			          totals for the run and the measurements of every stage
+		"""
+		if self.concurrent:
+			attribution = ("whole run: stages overlapped, so http_requests, cache_hits, cache_misses and peak_bytes of each stage "
+						   "are None and only the totals below are reported, stage cpu_seconds only count the thread running the stage "
+						   "(run with one worker for each stage's counters)")
+		else:
+			attribution = "per stage: stages ran one after another, every stage has its own counters"
+
+		report = {"started": self.started,
+				  "wall_seconds": time.perf_counter() - self.start,
+				  "concurrent": self.concurrent,
+				  "attribution": attribution,
+				  "http": None if self.client is None else dict(self.client.stats),
+				  "cache": cache.get_cache_stats(self.database)}
+
+		if self.concurrent and self.trace_memory and tracemalloc.is_tracing():
+			report["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+		report["stages"] = self.stages
+
+		return report
+
+	def write_report(self, report_name = RUN_REPORT):
+		"""
+		Write the run report as json.
+
+		@params
+			- report_name: name of the report file
+		@returns
+			- report: dictionary that was written (see get_report)
+		"""
+		report = self.get_report()
+
+		#write to a temporary file first so an interrupted write never leaves a truncated report
+		temporary_name = report_name + ".tmp"
+		with open(temporary_name, "w") as file:
+			json.dump(report, file, indent = 4, default = str)
+		os.replace(temporary_name, report_name)
+
+		return report
+
+	def close(self):
+		"""
+		Stop tracing memory if this profiler started it.
+
+		@params
+			- none
+		@returns
+			- none
+		"""
+		if self.started_tracing:
+			tracemalloc.stop()
+			self.started_tracing = False
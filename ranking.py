@@ -0,0 +1,163 @@
+"""
+Module that contains ranked indexes of parts, used to find the most at risk parts without sorting every part per query.
+
+An index holds the part ids sorted by each of RANKED_FIELDS, along with the sorted values so ranges can be found
+by binary search, and the part ids of each risk level ordered by estimated_rop (most urgent first).
+Ties are broken by part id so every query gives the same order as get_top_n.
+
+"""
+
+import heapq
+from bisect import bisect_left, bisect_right
+
+
+RANKED_FIELDS = ("estimated_rop", "days_since_last_batch", "total_stock")
+PAGE_SIZE = 50 #parts per page
+
+
+def build_index(sorted_stock, index = None, fields = RANKED_FIELDS):
+	"""
+	Build ranked indexes over sorted data, after risk levels have been calculated.
+
+	@params
+		- sorted_stock: nested dictionary containg data for all valid parts, with risk levels
+		- index: optional dictionary that is cleared and filled with the index (e.g. passed to calculate.get_risk_level)
+		- fields: fields to rank parts by
+	@returns
+		- index: dictionary containing
+			- fields: dictionary of field names to dictionaries with values (sorted ascending) and the part_ids in the same order
+			- risk_levels: dictionary of risk levels to part ids ordered by estimated_rop
+	"""
+	if index is None:
+		index = {}
+	index.clear()
+	index["fields"] = {}
+
+	for field in fields:
+		ranked = sorted((part[field], part_id) for part_id, part in sorted_stock.items())
+		index["fields"][field] = {"values": [value for value, part_id in ranked],
+								  "part_ids": [part_id for value, part_id in ranked]}
+
+	#walking the parts in order of estimated_rop keeps every bucket ordered by it
+	if "estimated_rop" in index["fields"]:
+		part_ids = index["fields"]["estimated_rop"]["part_ids"]
+	else:
+		part_ids = sorted(sorted_stock, key = lambda part_id: (sorted_stock[part_id]["estimated_rop"], part_id))
+
+	index["risk_levels"] = {}
+	for part_id in part_ids:
+		index["risk_levels"].setdefault(sorted_stock[part_id]["risk_level"], []).append(part_id)
+
+	return index
+
+
+def get_top(index, field, n, largest = False):
+	"""
+	Get the n parts with the smallest (or largest) values of a field from an index.
+
+	@params
+		- index: dictionary from build_index
+		- field: one of the ranked fields (e.g. "estimated_rop", smallest first gives the most urgent parts)
+		- n: number of parts
+		- largest: bool flag (set to true to get the parts with the largest values)
+	@returns
+		- part_ids: list of up to n part ids, in ranked order
+	"""
+	part_ids = index["fields"][field]["part_ids"]
+
+	if largest:
+		return part_ids[:-n - 1:-1] if n > 0 else []
+
+	return part_ids[:max(0, n)]
+
+
+def get_range(index, field, low = None, high = None, offset = 0, limit = None):
+	"""
+	Get the parts with a field between two values, e.g. estimated_rop between 0 and 30 days.
+
+	@params
+		- index: dictionary from build_index
+		- field: one of the ranked fields
+		- low: smallest value included, None for no lower bound
+		- high: largest value included, None for no upper bound
+		- offset: number of matching parts to skip, for paging through a range
+		- limit: optional largest number of part ids returned
+	@returns
+		- result: dictionary with the part_ids (ascending by field) and the total number of parts in the range
+	"""
+	ranked = index["fields"][field]
+	start = 0 if low is None else bisect_left(ranked["values"], low)
+	end = len(ranked["values"]) if high is None else bisect_right(ranked["values"], high)
+	end = max(start, end)
+
+	first = start + max(0, offset)
+	last = end if limit is None else min(end, first + max(0, limit))
+
+	result = {"part_ids": ranked["part_ids"][first:last], "total": end - start}
+
+	return result
+
+
+def get_page(index, field, page = 0, page_size = PAGE_SIZE, largest = False):
+	"""
+	Get one page of the parts ranked by a field.
+
+	@params
+		- index: dictionary from build_index
+		- field: one of the ranked fields
+		- page: page number, starting at 0
+		- page_size: number of parts per page
+		- largest: bool flag (set to true to rank the largest values first)
+	@returns
+		- result: dictionary with the part_ids on the page, the page number, number of pages and total number of parts
+	"""
+	part_ids = index["fields"][field]["part_ids"]
+	total = len(part_ids)
+	start = max(0, page) * page_size
+
+	if largest:
+		page_ids = part_ids[max(0, total - start - page_size):max(0, total - start)][::-1]
+	else:
+		page_ids = part_ids[start:start + page_size]
+
+	result = {"part_ids": page_ids, "page": page, "pages": -(-total // page_size), "total": total}
+
+	return result
+
+
+def get_bucket(index, risk_level, offset = 0, limit = None):
+	"""
+	Get the parts at a risk level, most urgent (smallest estimated_rop) first.
+
+	@params
+		- index: dictionary from build_index
+		- risk_level: risk level (see calculate.get_risk_level)
+		- offset: number of parts to skip, for paging
+		- limit: optional largest number of part ids returned
+	@returns
+		- part_ids: list of part ids, empty if no part has the risk level
+	"""
+	part_ids = index["risk_levels"].get(risk_level, [])
+	end = None if limit is None else max(0, offset) + max(0, limit)
+
+	return part_ids[max(0, offset):end]
+
+
+def get_top_n(sorted_stock, field, n, largest = False):
+	"""
+	Get the n parts with the smallest (or largest) values of a field without an index.
+
+	Keeps a heap of n parts while scanning, O(number of parts * log n), for when only the head of the ranking is needed.
+
+	@params
+		- sorted_stock: nested dictionary containg data for all valid parts
+		- field: field to rank parts by
+		- n: number of parts
+		- largest: bool flag (set to true to get the parts with the largest values)
+	@returns
+		- part_ids: list of up to n part ids, in the same order as get_top
+	"""
+	select = heapq.nlargest if largest else heapq.nsmallest
+	ranked = select(n, ((part[field], part_id) for part_id, part in sorted_stock.items()))
+
+	return [part_id for value, part_id in ranked]
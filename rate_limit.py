@@ -0,0 +1,76 @@
+"""
+Module that contains a thread safe token bucket and retry backoff for rate limited api requests
+
+"""
+
+import random
+import threading
+import time
+
+
+class TokenBucket:
+	"""
+	Thread safe token bucket rate limiter.
+
+	Tokens are added at a fixed rate up to the capacity of the bucket, every request takes one token.
+	When the bucket is empty a request reserves the next token and sleeps until it is added,
+	so waiting requests are released in order, evenly spaced at the rate limit.
+
+	@params
+		- calls: number of calls (integer) that can take place during one period
+		- period: time period (seconds)
+		- capacity: maximum number of calls that can be made at once after being idle, defaults to calls
+	"""
+
+	def __init__(self, calls, period = 1, capacity = None):
+		self.rate = calls / period #tokens added per second
+		self.capacity = calls if capacity is None else capacity
+		self.tokens = self.capacity
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		"""
+		Take a token, waiting until one is available.
+
+		@params
+			- none
+		@returns
+			- wait: time waited for the token (seconds)
+		"""
+		with self.lock:
+			now = time.monotonic()
+			self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+
+			#reserve a token, a negative count is the number of tokens already promised to waiting calls
+			self.tokens = self.tokens - 1
+			wait = max(0, -self.tokens / self.rate)
+
+		if wait:
+			time.sleep(wait)
+
+		return wait
+
+
+def get_backoff(attempt, retry_after = None, base = 0.5, maximum = 30):
+	"""
+	Get the time to wait before retrying a request.
+
+	@params
+		- attempt: number of attempts already made (integer, starting at 1)
+		- retry_after: value of the Retry-After response header if the server sent one
+		- base: wait before the first retry (seconds)
+		- maximum: longest wait (seconds)
+	@returns
+		- backoff: time to wait (seconds), exponential in attempt with random jitter unless the server gave a wait
+	"""
+	if retry_after is not None:
+		try:
+			return min(maximum, float(retry_after))
+		except ValueError: #Retry-After given as an http date, fall back to exponential backoff
+			pass
+
+	backoff = min(maximum, base * 2 ** (attempt - 1))
+
+	return backoff + random.uniform(0, base)
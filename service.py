@@ -0,0 +1,478 @@
+"""
+Long running service mode for the partsbox api interface.
+
+The inventory and computed risk metrics are kept in memory and refreshed in the background on a schedule,
+a local http api answers queries from the latest refresh without waiting on a run.
+
+endpoints (GET unless noted, every response is json):
+	/health                           time of the last refresh, number of parts, last error and request latency percentiles
+	/parts/<part id>                  risk metrics of a part
+	/risk/<risk level>                parts at a risk level, most urgent first (e.g. /risk/High, /risk/Overdue%20for%20batch),
+	                                  ?offset=0&limit=50 pages through them
+	/top/<field>                      parts ranked by estimated_rop, days_since_last_batch or total_stock, ?n=10&largest=true
+	/range/<field>                    parts with a field in a range, ?low=0&high=30&offset=0&limit=50
+	/projects/<project name>/parts    parts used by a project, ?risk=High&risk=Medium keeps only those risk levels
+	POST /refresh                     start a refresh now
+
+usage: python service.py [--port 8765] [--interval 900] [--account name] [--push] [--update-lead-times]
+
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+import main
+import partsbox
+import pipeline
+import profiler
+import ranking
+import sort_data
+
+
+HOST = "127.0.0.1"
+PORT = 8765
+REFRESH_INTERVAL = 900 #(seconds)
+LATENCY_SAMPLES = 10000 #number of recent request latencies kept for the percentiles in /health
+#fields of a part returned by the api
+SUMMARY_FIELDS = ("description", "mpn", "total_stock", "risk_level", "estimated_rop", "days_since_last_batch",
+				  "date_last_batch", "part/restock", "lead_time_(weeks)", "projects_used_in")
+#stages only needed to push to airtable, left out unless the service also pushes
+AIRTABLE_STAGES = ("get_data_for_airtable", "push_to_airtable")
+#stages that write lead times to PartsBox, left out unless the service also updates them
+LEAD_TIME_STAGES = ("update_lead_times",)
+
+
+def get_state(sorted_stock, project_index, risk_index = None):
+	"""
+	Build the query state of a refresh, everything a query needs is looked up instead of computed.
+
+	@params
+		- sorted_stock: nested dictionary containg data for all valid parts, with risk levels and project data
+		- project_index: dictionary from sort_data.build_project_index
+		- risk_index: optional dictionary from ranking.build_index, built from sorted_stock if not given
+	@returns
+		- state: dictionary with the summary of every part (SUMMARY_FIELDS), the ranked indexes,
+		         the project index and the time of the refresh
+	"""
+	summaries = {}
+	for part_id, part in sorted_stock.items():
+		summaries[part_id] = {"part_id": part_id}
+		for field in SUMMARY_FIELDS:
+			summaries[part_id][field] = part.get(field)
+
+	if risk_index is None:
+		risk_index = ranking.build_index(sorted_stock)
+
+	state = {"summaries": summaries,
+			 "risk_index": risk_index,
+			 "project_index": project_index,
+			 "refreshed": time.time()}
+
+	return state
+
+
+class Service:
+	"""
+	Keeps the results of the latest run in memory and refreshes them in a background thread.
+
+	A refresh builds a new state and swaps it in, queries always read a complete state
+	(the latest one, or the previous one while a refresh is running).
+
+	@params
+		- account: dictionary from main.get_accounts
+		- client: PartsBoxClient for the account
+		- interval: time between refreshes (seconds)
+		- push: bool flag (set to true to also push every refresh to airtable)
+		- analytics_workers: number of processes used to recalculate averages
+		- workers: number of stages run at once
+		- update_lead_times: bool flag (set to true to also write default lead times to PartsBox on every refresh)
+	"""
+
+	def __init__(self, account, client, interval = REFRESH_INTERVAL, push = False, analytics_workers = 1, workers = pipeline.WORKERS, update_lead_times = False):
+		self.account = account
+		self.client = client
+		self.interval = interval
+		self.push = push
+		self.update_lead_times = update_lead_times
+		self.analytics_workers = analytics_workers
+		self.workers = workers
+
+		self.state = None
+		self.status = {"refreshes": 0, "refresh_seconds": None, "stage_seconds": None, "error": None, "refreshing": False}
+		self.latencies = deque(maxlen = LATENCY_SAMPLES)
+		self.lock = threading.Lock()
+		self.refresh_lock = threading.Lock() #only one refresh runs at a time
+		self.wake = threading.Event()
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def get_stages(self, update):
+		"""
+		Get the stages of a refresh.
+
+		@params
+			- update: bool flag to force fetching parts from PartsBox, None uses the cache rules of a normal run
+		@returns
+			- stages: list of pipeline.Stage (see main.get_stages)
+		"""
+		stages = main.get_stages(self.analytics_workers, tenant = main.get_tenant(self.account))
+		if not self.push:
+			stages = [stage for stage in stages if stage.name not in AIRTABLE_STAGES]
+		if not self.update_lead_times:
+			stages = [stage for stage in stages if stage.name not in LEAD_TIME_STAGES]
+		if update is not None:
+			stages = [pipeline.Stage("get_update_flag", lambda Timestamps: update, inputs = ("Timestamps",), outputs = ("update",))
+					  if stage.name == "get_update_flag" else stage for stage in stages]
+
+		return stages
+
+	def refresh(self, update = None):
+		"""
+		Run every stage and swap in the new state, the previous state is kept if the run fails.
+
+		@params
+			- update: bool flag to force fetching parts from PartsBox, None uses the cache rules of a normal run
+		@returns
+			- state: the new state (see get_state), None if the run failed
+		"""
+		with self.refresh_lock:
+			self.status["refreshing"] = True
+			#requests are served while refreshing, so only the thread running each stage is counted,
+			#stage times are kept for /health instead of printed on every refresh
+			stages = profiler.StageProfiler(client = self.client, trace_memory = False, concurrent = True,
+											database = main.get_tenant(self.account)["database"], quiet = True)
+			start = time.perf_counter()
+			keys = self.account["partsbox"]
+			values = {"client": self.client,
+					  "read_headers": {"Authorization": keys[main.READ]["API_key"], "Content-Type" : "application/json"},
+					  "write_headers": {"Authorization": keys[main.WRITE]["API_key"]}}
+
+			try:
+				values = pipeline.run(self.get_stages(update), values, workers = self.workers, profiler = stages)
+				state = get_state(values["sorted_stock"], values["project_index"], values["risk_index"])
+			except Exception as e:
+				print(f"refresh failed, keeping the previous state: {e!r}")
+				self.status["error"] = repr(e)
+				state = None
+			else:
+				self.status["error"] = None
+				with self.lock:
+					self.state = state
+			finally:
+				self.status["refreshing"] = False
+
+			self.status["refreshes"] += 1
+			self.status["stage_seconds"] = {stage["name"]: stage["wall_seconds"] for stage in stages.stages}
+			self.status["refresh_seconds"] = time.perf_counter() - start
+
+		return state
+
+	def run(self):
+		"""
+		Refresh on startup and then every interval, until stop is called.
+
+		The first refresh uses the cache like a normal run so the service starts quickly,
+		later refreshes always fetch the parts from PartsBox.
+
+		@params
+			- none
+		@returns
+			- none
+		"""
+		update = None
+		while not self.stopped.is_set():
+			self.refresh(update)
+			update = True
+			self.wake.wait(self.interval)
+			self.wake.clear()
+
+	def start(self):
+		"""
+		Start refreshing in a background thread.
+
+		@params
+			- none
+		@returns
+			- service: this service
+		"""
+		self.thread = threading.Thread(target = self.run, name = "refresh", daemon = True)
+		self.thread.start()
+
+		return self
+
+	def stop(self):
+		self.stopped.set()
+		self.wake.set()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+	def request_refresh(self):
+		"""Start a refresh now instead of waiting for the interval."""
+		self.wake.set()
+
+	def record_latency(self, seconds):
+		with self.lock:
+			self.latencies.append(seconds)
+
+	def get_health(self):
+		"""
+		Get the status of the service.
+
+		@params
+			- none
+		@returns
+			- health: dictionary with the time of the last refresh, number of parts, refresh status
+			          and p50/p99 latency of recent requests (milliseconds)
+		"""
+		with self.lock:
+			state = self.state
+			latencies = sorted(self.latencies)
+
+		health = dict(self.status)
+		health["ready"] = state is not None
+		health["refreshed"] = None if state is None else state["refreshed"]
+		health["parts"] = 0 if state is None else len(state["summaries"])
+		health["requests"] = len(latencies)
+		for name, percentile in (("p50_ms", 0.50), ("p99_ms", 0.99)):
+			health[name] = latencies[min(len(latencies) - 1, int(percentile * len(latencies)))] * 1000 if latencies else None
+
+		return health
+
+	def get_part(self, part_id):
+		"""
+		Get the risk metrics of a part.
+
+		@params
+			- part_id: id of the part
+		@returns
+			- summary: dictionary of SUMMARY_FIELDS, None if the part is not in the inventory
+		"""
+		return self.state["summaries"].get(part_id)
+
+	def get_risk_parts(self, risk_level, offset = 0, limit = None):
+		"""
+		Get the parts at a risk level.
+
+		@params
+			- risk_level: risk level (e.g. "High")
+			- offset: number of parts to skip
+			- limit: optional largest number of parts returned
+		@returns
+			- result: dictionary with the part summaries, most urgent (smallest estimated_rop) first,
+			          and the total number of parts at the risk level
+		"""
+		state = self.state
+		part_ids = ranking.get_bucket(state["risk_index"], risk_level, offset, limit)
+		result = {"parts": [state["summaries"][part_id] for part_id in part_ids],
+				  "total": len(state["risk_index"]["risk_levels"].get(risk_level, ()))}
+
+		return result
+
+	def get_top_parts(self, field, n, largest = False):
+		"""
+		Get the parts with the smallest (or largest) values of a ranked field.
+
+		@params
+			- field: one of ranking.RANKED_FIELDS
+			- n: number of parts
+			- largest: bool flag (set to true to get the largest values first)
+		@returns
+			- summaries: list of up to n part summaries, in ranked order
+		"""
+		state = self.state
+		return [state["summaries"][part_id] for part_id in ranking.get_top(state["risk_index"], field, n, largest)]
+
+	def get_range_parts(self, field, low = None, high = None, offset = 0, limit = None):
+		"""
+		Get the parts with a ranked field between two values.
+
+		@params
+			- field: one of ranking.RANKED_FIELDS
+			- low: smallest value included, None for no lower bound
+			- high: largest value included, None for no upper bound
+			- offset: number of matching parts to skip
+			- limit: optional largest number of parts returned
+		@returns
+			- result: dictionary with the part summaries (ascending by field) and the total number of parts in the range
+		"""
+		state = self.state
+		found = ranking.get_range(state["risk_index"], field, low, high, offset, limit)
+		result = {"parts": [state["summaries"][part_id] for part_id in found["part_ids"]], "total": found["total"]}
+
+		return result
+
+	def get_project_parts(self, project_name, risk_levels = None):
+		"""
+		Get the parts used by a project.
+
+		@params
+			- project_name: name of the project
+			- risk_levels: optional risk levels, only parts at these levels are returned
+		@returns
+			- summaries: list of part summaries in bom order, None if there is no project with this name
+		"""
+		state = self.state
+		index = state["project_index"]
+		if project_name not in index["projects"]:
+			return None
+
+		part_ids = sort_data.get_project_parts(index, state["summaries"], project_name, risk_levels or None)
+
+		return [state["summaries"][part_id] for part_id in part_ids]
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+	"""
+	Request handler for the query api, self.server.service is the Service queried.
+	"""
+
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, format, *args):
+		pass
+
+	def send_json(self, status, body):
+		data = json.dumps(body, default = str).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def get_response(self, method):
+		"""
+		Answer a request.
+
+		@params
+			- method: http method
+		@returns
+			- status: http status code
+			- body: json data of the response
+		"""
+		service = self.server.service
+		url = urlparse(self.path)
+		path = [unquote(part) for part in url.path.strip("/").split("/")]
+
+		if method == "POST":
+			if path == ["refresh"]:
+				service.request_refresh()
+				return 202, {"refreshing": True}
+			return 404, {"error": f"unknown endpoint POST {url.path}"}
+
+		if path == ["health"]:
+			return 200, service.get_health()
+		if service.state is None:
+			return 503, {"error": "no data yet, the first refresh is still running"}
+
+		if len(path) == 2 and path[0] == "parts":
+			summary = service.get_part(path[1])
+			if summary is None:
+				return 404, {"error": f"unknown part {path[1]}"}
+			return 200, summary
+
+		query = parse_qs(url.query)
+		try:
+			offset = int(query.get("offset", ["0"])[0])
+			limit = int(query["limit"][0]) if "limit" in query else None
+			n = int(query.get("n", ["10"])[0])
+			low = float(query["low"][0]) if "low" in query else None
+			high = float(query["high"][0]) if "high" in query else None
+		except ValueError as e:
+			return 400, {"error": f"invalid query parameter: {e}"}
+		largest = query.get("largest", ["false"])[0].lower() in ("1", "true", "yes")
+
+		if len(path) == 2 and path[0] == "risk":
+			result = service.get_risk_parts(path[1], offset, limit)
+			return 200, {"risk_level": path[1], "count": len(result["parts"]), "total": result["total"], "parts": result["parts"]}
+
+		if len(path) == 2 and path[0] in ("top", "range"):
+			if path[1] not in service.state["risk_index"]["fields"]:
+				return 404, {"error": f"unknown field {path[1]}, expected one of {list(service.state['risk_index']['fields'])}"}
+			if path[0] == "top":
+				parts = service.get_top_parts(path[1], n, largest)
+				return 200, {"field": path[1], "count": len(parts), "parts": parts}
+			result = service.get_range_parts(path[1], low, high, offset, limit)
+			return 200, {"field": path[1], "low": low, "high": high, "count": len(result["parts"]), "total": result["total"], "parts": result["parts"]}
+
+		if len(path) == 3 and path[0] == "projects" and path[2] == "parts":
+			risk_levels = query.get("risk")
+			parts = service.get_project_parts(path[1], risk_levels)
+			if parts is None:
+				return 404, {"error": f"unknown project {path[1]}"}
+			return 200, {"project": path[1], "count": len(parts), "parts": parts}
+
+		return 404, {"error": f"unknown endpoint GET {url.path}"}
+
+	def handle_request(self, method):
+		start = time.perf_counter()
+		try:
+			status, body = self.get_response(method)
+		except Exception as e:
+			#a failed query still gets a json answer instead of a dropped connection
+			status, body = 500, {"error": repr(e)}
+		self.send_json(status, body)
+		self.server.service.record_latency(time.perf_counter() - start)
+
+	def do_GET(self):
+		self.handle_request("GET")
+
+	def do_POST(self):
+		self.handle_request("POST")
+
+
+def get_server(service, host = HOST, port = PORT):
+	"""
+	Create the http server for the query api.
+
+	@params
+		- service: Service to query
+		- host: address to listen on, the default only accepts local connections
+		- port: port to listen on, 0 picks a free port
+	@returns
+		- server: ThreadingHTTPServer, call serve_forever to answer requests
+	"""
+	server = ThreadingHTTPServer((host, port), ServiceHandler)
+	server.daemon_threads = True
+	server.service = service
+
+	return server
+
+
+"""main"""
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = "keep PartsBox risk metrics in memory and answer queries over a local http api")
+	parser.add_argument("--host", default = HOST)
+	parser.add_argument("--port", type = int, default = PORT)
+	parser.add_argument("--interval", type = float, default = REFRESH_INTERVAL, help = "time between refreshes (seconds)")
+	parser.add_argument("--account", help = "name of the account to serve, for multi account configs (defaults to the first account)")
+	parser.add_argument("--push", action = "store_true", help = "also push every refresh to airtable")
+	parser.add_argument("--update-lead-times", action = "store_true", help = "also write default lead times to PartsBox on every refresh")
+	parser.add_argument("--workers", type = int, default = pipeline.WORKERS, help = "number of stages run at once")
+	parser.add_argument("--analytics-workers", type = int, default = 1, help = "number of processes used to recalculate averages")
+	args = parser.parse_args()
+
+	with open("partsbox_config.json") as config_file:
+		accounts = main.get_accounts(json.load(config_file))
+
+	account = accounts[0] if args.account is None else next((account for account in accounts if account["name"] == args.account), None)
+	if account is None:
+		raise SystemExit(f"no account named {args.account} in partsbox_config.json")
+
+	client = partsbox.get_client() if account["name"] is None else partsbox.PartsBoxClient(base_url = account.get("base_url", partsbox.BASE_URL))
+	service = Service(account, client, args.interval, args.push, args.analytics_workers, args.workers, args.update_lead_times).start()
+	server = get_server(service, args.host, args.port)
+
+	print(f"serving on http://{server.server_address[0]}:{server.server_address[1]}/")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		service.stop()
+		client.close()
@@ -0,0 +1,218 @@
+"""
+Module that generates synthetic PartsBox data for benchmarks and testing.
+
+Payloads have the same shape as the part/all, project/all and project/get-entries api responses,
+the same seed always gives the same data.
+
+"""
+
+import json
+import os
+import random
+import time
+
+
+SEED = 1
+SIZES = {"small": 1000, "medium": 20000, "large": 200000} #number of parts
+ENTRIES_PER_PART = 60 #average number of stock entries per part
+PARTS_PER_BOM = 40 #average number of parts in a project bom
+HISTORY_DAYS = 540 #stock history goes back about a year and a half
+MILLI_PER_DAY = 86400000
+MOVE_CHANCE = 0.15 #chance a stock entry is a move between storage locations
+RESTOCK_CHANCE = 0.2 #chance a stock entry that is not a move is a restock
+EMPTY_CHANCE = 0.05 #chance a part has no stock history
+MISSING_LEAD_CHANCE = 0.02 #chance a part has no lead time custom field
+
+
+def get_id(prefix, number):
+	"""
+	Get a PartsBox style id (26 characters).
+
+	@params
+		- prefix: single character used to tell kinds of ids apart
+		- number: number of the record (integer)
+	@returns
+		- id: string id
+	"""
+	return f"{prefix}{number:025d}"
+
+
+def get_stock(rng, number_of_entries, current_timestamp):
+	"""
+	Generate the stock history of a single part, oldest entry first.
+
+	@params
+		- rng: random.Random used for all choices
+		- number_of_entries: number of stock entries
+		- current_timestamp: unix timestamp, in milliseconds (integer), every entry is earlier than this
+	@returns
+		- part_stock: list of stock entries
+	"""
+	part_stock = []
+	if not number_of_entries:
+		return part_stock
+
+	#entries are spread over the history with a mean gap that keeps the last entry before current_timestamp
+	timestamp = current_timestamp - rng.randint(1, HISTORY_DAYS) * MILLI_PER_DAY
+	mean_gap = (current_timestamp - timestamp) / (number_of_entries + 1)
+
+	for stock_entry in range(number_of_entries):
+		timestamp = min(current_timestamp - 1, timestamp + int(rng.expovariate(1 / mean_gap)))
+		chance = rng.random()
+
+		stock = {"stock/storage-id": get_id("s", rng.randint(0, 50)), "stock/timestamp": timestamp}
+
+		if chance < MOVE_CHANCE:
+			stock["stock/quantity"] = rng.choice((-1, 1)) * rng.randint(1, 100)
+			stock["stock/comments"] = "Moved to new location"
+		elif chance < MOVE_CHANCE + RESTOCK_CHANCE:
+			stock["stock/quantity"] = rng.randint(50, 1000)
+			stock["stock/comments"] = "restock"
+		else:
+			stock["stock/quantity"] = -rng.randint(1, 100)
+			if rng.random() < 0.5:
+				stock["stock/comments"] = "used for build"
+
+		part_stock.append(stock)
+
+	return part_stock
+
+
+def get_parts(number_of_parts, entries_per_part = ENTRIES_PER_PART, seed = SEED, current_timestamp = None):
+	"""
+	Generate parts in the format of the part/all data list.
+
+	Parts are yielded one at a time so very large inventories do not have to be held in memory.
+
+	@params
+		- number_of_parts: number of parts to generate
+		- entries_per_part: average number of stock entries per part, the number for each part is uniform between 0 and twice this
+		- seed: seed for the random number generator
+		- current_timestamp: unix timestamp, in milliseconds (integer), defaults to now
+	@returns
+		- parts: generator of part dictionaries
+	"""
+	rng = random.Random(seed)
+	if current_timestamp is None:
+		current_timestamp = int(time.time()) * 1000
+
+	for part_number in range(number_of_parts):
+		if rng.random() < EMPTY_CHANCE:
+			number_of_entries = 0
+		else:
+			number_of_entries = rng.randint(1, 2 * entries_per_part)
+
+		part = {"part/id": get_id("p", part_number),
+				"part/name": f"Part {part_number}",
+				"part/description": f"synthetic part {part_number}",
+				"part/mpn": f"MPN-{rng.randint(0, 999999):06d}",
+				"part/type": "local",
+				"part/created": current_timestamp - HISTORY_DAYS * MILLI_PER_DAY,
+				"part/custom-fields": [],
+				"part/stock": get_stock(rng, number_of_entries, current_timestamp)}
+
+		if rng.random() >= MISSING_LEAD_CHANCE:
+			part["part/custom-fields"].append({"key": "lead_time_(weeks)", "value": str(rng.randint(1, 12))})
+
+		yield part
+
+
+def get_projects(number_of_projects, seed = SEED, current_timestamp = None):
+	"""
+	Generate a project/all payload.
+
+	@params
+		- number_of_projects: number of projects to generate
+		- seed: seed for the random number generator
+		- current_timestamp: unix timestamp, in milliseconds (integer), defaults to now
+	@returns
+		- payload: dictionary in the format of the project/all api response
+	"""
+	rng = random.Random(seed)
+	if current_timestamp is None:
+		current_timestamp = int(time.time()) * 1000
+	projects = []
+
+	for project_number in range(number_of_projects):
+		projects.append({"project/id": get_id("j", project_number),
+						 "project/name": f"Project {project_number}",
+						 "project/description": f"synthetic project {project_number}",
+						 "project/created": current_timestamp - rng.randint(0, HISTORY_DAYS) * MILLI_PER_DAY})
+
+	payload = {"data": projects}
+
+	return payload
+
+
+def get_project_entries(number_of_projects, number_of_parts, parts_per_bom = PARTS_PER_BOM, seed = SEED):
+	"""
+	Generate a project/get-entries payload for every project.
+
+	@params
+		- number_of_projects: number of projects, ids match those from get_projects
+		- number_of_parts: number of parts, boms only use ids that exist in get_parts
+		- parts_per_bom: average number of parts in a bom
+		- seed: seed for the random number generator
+	@returns
+		- payloads: dictionary of project ids to dictionaries in the format of the project/get-entries api response
+	"""
+	rng = random.Random(seed)
+	payloads = {}
+
+	for project_number in range(number_of_projects):
+		bom_size = min(number_of_parts, rng.randint(1, 2 * parts_per_bom))
+		entries = []
+		for entry_number, part_number in enumerate(rng.sample(range(number_of_parts), bom_size)):
+			entries.append({"entry/id": get_id("e", project_number * 10000 + entry_number),
+							"entry/part-id": get_id("p", part_number),
+							"entry/quantity": rng.randint(1, 20),
+							"entry/designators": []})
+
+		payloads[get_id("j", project_number)] = {"data": entries}
+
+	return payloads
+
+
+def get_payloads(number_of_parts, entries_per_part = ENTRIES_PER_PART, number_of_projects = None, seed = SEED, current_timestamp = None):
+	"""
+	Generate every payload for one synthetic inventory.
+
+	@params
+		- number_of_parts: number of parts
+		- entries_per_part: average number of stock entries per part
+		- number_of_projects: number of projects, defaults to one per 100 parts
+		- seed: seed for the random number generator
+		- current_timestamp: unix timestamp, in milliseconds (integer), defaults to now
+	@returns
+		- payloads: dictionary with the part/all, project/all and project/get-entries payloads
+	"""
+	if number_of_projects is None:
+		number_of_projects = max(1, number_of_parts // 100)
+
+	payloads = {"part/all": {"data": list(get_parts(number_of_parts, entries_per_part, seed, current_timestamp))},
+				"project/all": get_projects(number_of_projects, seed, current_timestamp),
+				"project/get-entries": get_project_entries(number_of_projects, number_of_parts, seed = seed)}
+
+	return payloads
+
+
+def write_payloads(payloads, directory):
+	"""
+	Write payloads to json files, one file per endpoint (e.g. part/all is written to part_all.json).
+
+	@params
+		- payloads: dictionary of endpoints to payloads, as returned by get_payloads
+		- directory: directory the files are written to, created if it does not exist
+	@returns
+		- file_names: list of files written
+	"""
+	os.makedirs(directory, exist_ok = True)
+	file_names = []
+
+	for endpoint in payloads:
+		file_name = os.path.join(directory, endpoint.replace("/", "_") + ".json")
+		with open(file_name, "w") as file:
+			json.dump(payloads[endpoint], file)
+		file_names.append(file_name)
+
+	return file_names
@@ -0,0 +1,84 @@
+import copy
+
+import pytest
+
+import calculate
+import columnar
+import sort_data
+import synthetic_data
+import time_stamp
+
+
+NUMBER_OF_PARTS = 3000
+
+
+def get_stock_entry(timestamp, quantity):
+	return {"stock/storage-id": synthetic_data.get_id("s", 0), "stock/timestamp": timestamp, "stock/quantity": quantity}
+
+
+@pytest.fixture(scope = "module")
+def Timestamps():
+	return time_stamp.get_timestamps()
+
+
+@pytest.fixture(scope = "module")
+def sorted_stock(Timestamps):
+	parts = list(synthetic_data.get_parts(NUMBER_OF_PARTS, current_timestamp = Timestamps[0]))
+	for part in sort_data.get_missing_leads(parts):
+		sort_data.set_lead(part, sort_data.DEFAULT_LEAD_TIME)
+	sorted_stock = sort_data.scan_stock(parts)
+	template = next(iter(sorted_stock.values()))
+
+	def add_part(part_id, stock):
+		part = copy.deepcopy(template)
+		part["stock"] = stock
+		sorted_stock[part_id] = part
+
+	#entries exactly on, just before and just after each time period boundary
+	for period in (1, 3, 6, 12):
+		boundary = Timestamps[period]
+		add_part(f"on_{period}", [get_stock_entry(boundary, -10)])
+		add_part(f"around_{period}", [get_stock_entry(boundary - 1, -7), get_stock_entry(boundary, -5), get_stock_entry(boundary + 1, -3)])
+	add_part("every_boundary", [get_stock_entry(Timestamps[period], -period) for period in (12, 6, 3, 1)])
+
+	#parts with too little data for averages
+	add_part("no_entries", [])
+	add_part("one_entry", [get_stock_entry(Timestamps[0] - 1, -4)])
+	add_part("one_old_entry", [get_stock_entry(Timestamps[12] - 1, -4)])
+	add_part("no_recent_entries", [get_stock_entry(Timestamps[12] - 2, -4), get_stock_entry(Timestamps[12] - 1, -6)])
+
+	return sorted_stock
+
+
+def get_averages(engine, sorted_stock, Timestamps):
+	sorted_stock = copy.deepcopy(sorted_stock)
+	sorted_stock = engine.get_avg_batch(sorted_stock, Timestamps)
+	sorted_stock = engine.get_avg_time(sorted_stock, Timestamps)
+
+	return sorted_stock
+
+
+def get_risk_levels(engine, sorted_stock, Timestamps):
+	#scan_stock never keeps a part without stock entries, time since last batch needs at least one
+	sorted_stock = {part: data for part, data in get_averages(engine, sorted_stock, Timestamps).items() if data["stock"]}
+	sorted_stock = time_stamp.get_time_since_last_batch(Timestamps[0], sorted_stock)
+	sorted_stock = engine.get_risk_level(sorted_stock, Timestamps[0])
+
+	return sorted_stock
+
+
+def assert_same(result, expected):
+	assert result.keys() == expected.keys()
+	for part in expected:
+		assert result[part] == expected[part], part
+		#equal values of different types (1 and 1.0) would still change the airtable payload
+		for field in expected[part]:
+			assert type(result[part][field]) is type(expected[part][field]), (part, field)
+
+
+def test_averages_match_calculate(sorted_stock, Timestamps):
+	assert_same(get_averages(columnar, sorted_stock, Timestamps), get_averages(calculate, sorted_stock, Timestamps))
+
+
+def test_risk_levels_match_calculate(sorted_stock, Timestamps):
+	assert_same(get_risk_levels(columnar, sorted_stock, Timestamps), get_risk_levels(calculate, sorted_stock, Timestamps))
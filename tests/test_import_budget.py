@@ -0,0 +1,11 @@
+import benchmark
+
+
+#a module level import of a heavy dependency in main (or anything it imports) fails here, not only in the benchmark
+def test_import_main_within_budget():
+	#each import runs in a fresh interpreter, the fastest of benchmark.REPEAT runs is kept
+	result = benchmark.check_import_budget()
+
+	assert result["seconds"] < benchmark.IMPORT_SECONDS
+	assert result["modules"] < benchmark.IMPORT_MODULES
+	assert result["heavy"] == []
@@ -0,0 +1,46 @@
+import pytest
+
+import mock_server
+import partsbox
+import sort_data
+import synthetic_data
+
+
+NUMBER_OF_PARTS = 200
+NUMBER_OF_PROJECTS = 12
+HEADERS = {"Authorization": "APIKey mock"}
+
+
+@pytest.fixture
+def payloads():
+	return synthetic_data.get_payloads(NUMBER_OF_PARTS, number_of_projects = NUMBER_OF_PROJECTS)
+
+
+def test_client_retries_rate_limited_request(payloads):
+	#one request per second, the second request is answered with a 429 and Retry-After of 1 second
+	with mock_server.MockServer(payloads, partsbox_limit = 1, port = 0) as server, partsbox.PartsBoxClient(base_url = server.base_url) as client:
+		first = client.get("project/all", headers = HEADERS)
+		second = client.get("project/all", headers = HEADERS)
+
+	assert first.ok and second.ok
+	assert second.json() == payloads["project/all"]
+	assert server.stats["project/all"] == {"requests": 3, "throttled": 1, "errors": 0}
+	assert client.stats == {"requests": 3, "retries": 1, "errors": 0}
+
+
+def test_get_boms_keeps_project_order(payloads, tmp_path):
+	projects = payloads["project/all"]["data"]
+	project_boms = {}
+
+	#jitter makes the concurrent requests finish out of order, the client has effectively no rate limit so the test stays fast
+	with mock_server.MockServer(payloads, latency = 0.01, jitter = 0.02, port = 0) as server, \
+		 partsbox.PartsBoxClient(base_url = server.base_url, calls = 1000000, period = 1) as client:
+		for workers in (1, 4):
+			project_boms[workers] = sort_data.get_boms(projects, HEADERS, workers = workers, client = client, cache_name = str(tmp_path / f"boms_{workers}.json"))
+		#every bom is read back from the cache
+		cached = sort_data.get_boms(projects, HEADERS, workers = 4, client = client, cache_name = str(tmp_path / "boms_4.json"))
+
+	assert [bom["project_name"] for bom in project_boms[4]] == [project["project/name"] for project in projects]
+	assert project_boms[4] == project_boms[1]
+	assert cached == project_boms[4]
+	assert server.stats["project/get-entries"]["requests"] == 2 * NUMBER_OF_PROJECTS
@@ -0,0 +1,38 @@
+import partsbox
+import rate_limit
+
+
+CALLS = 10
+PERIOD = 60 #(seconds)
+
+
+class Clock:
+	"""fake clock for rate_limit, sleeping moves the time forward instead of waiting"""
+
+	def __init__(self):
+		self.now = 1000.0
+
+	def monotonic(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now = self.now + seconds
+
+
+def test_client_never_goes_over_calls_in_any_period(monkeypatch):
+	clock = Clock()
+	monkeypatch.setattr(rate_limit, "time", clock)
+	client = partsbox.PartsBoxClient(calls = CALLS, period = PERIOD)
+	times = []
+
+	for request in range(4 * CALLS):
+		#idle long enough for the bucket to refill, the next requests must not go out as a burst
+		if request == 2 * CALLS:
+			clock.sleep(3 * PERIOD)
+		client.bucket.acquire()
+		times.append(clock.now)
+
+	for start, first in enumerate(times):
+		#1e-9 allows for rounding of the spacing between calls
+		in_window = sum(1 for later in times[start:] if later < first + PERIOD - 1e-9)
+		assert in_window <= CALLS
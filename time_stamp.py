@@ -3,9 +3,14 @@ Module that contains functions for dealing with timestamps
 
 """
 
+from bisect import bisect_left
 from datetime import datetime, timedelta
 
 
+MILLI_PER_DAY = 86400000
+MILLI_PER_WEEK = 604800000
+
+
 def get_timestamps():
     """
     Calculates Timestamps for 4 time periods. 
@@ -63,8 +68,6 @@ def get_difference(timestamp_1, timestamp_2):
     @returns 
         - difference: difference between two timestamps in days (integer)
     """    
-    MILLI_PER_DAY = 86400000
-
     difference_in_milli = timestamp_2 - timestamp_1
 
     difference = int(difference_in_milli / MILLI_PER_DAY)
@@ -72,6 +75,24 @@ def get_difference(timestamp_1, timestamp_2):
     return difference
 
 
+def get_date_string(timestamp):
+    """
+    Format a timestamp as a date string.
+
+    @params
+        - timestamp: unix timestamp, in milliseconds (integer)
+    @returns
+        - date_string: local date of the timestamp, formatted as YYYY-MM-DD
+    """
+    date = datetime.fromtimestamp(timestamp / 1000) #convert timestamp to seconds from milliseconds 
+    date = datetime.date(date)
+    format_string = '%Y-%m-%d'
+    # Convert the datetime object to a string in the specified format
+    date_string = date.strftime(format_string)
+
+    return date_string
+
+
 def get_similar_timeperiod(timestamp_1, timestamp_2, Timestamps):
     """
     Determine if two time stamps are in the same time period. 
@@ -132,6 +153,135 @@ def get_current_timeperiod(timestamp, Timestamps):
     return time_period
 
 
+class TimeWindows:
+    """
+    Time periods used for averages, built once and used to classify timestamps with binary search. 
+
+    Periods are consecutive and end at the current time, the first period is the most recent.
+    A timestamp is in a period if it is strictly between the period's start and end (same as get_current_timeperiod).
+
+    @params
+        - current_timestamp: unix timestamp, in milliseconds (integer), end of the most recent period
+        - starts: start of each period, unix timestamps in milliseconds, most recent first 
+        - names: name of each period (e.g. "1_month"), used as keys for averages 
+    """
+
+    def __init__(self, current_timestamp, starts, names):
+        if len(starts) != len(names):
+            raise ValueError("every time period needs a start and a name")
+
+        self.names = list(names)
+        #boundaries most recent first: current time, then the start of each period 
+        self.boundaries = [current_timestamp] + list(starts)
+        if any(self.boundaries[i] <= self.boundaries[i + 1] for i in range(len(starts))):
+            raise ValueError("time period starts must be in descending order and before the current time")
+
+        #ascending copy for bisect
+        self.ascending = self.boundaries[::-1]
+
+    @classmethod
+    def from_timestamps(cls, Timestamps):
+        """
+        Build the default 1, 3, 6 and 12 month periods.
+
+        @params
+            - Timestamps: dictionary of timestamps from get_timestamps
+        @returns 
+            - windows: TimeWindows with the periods "1_month", "3_months", "6_months" and "12_months"
+        """
+        months = sorted(key for key in Timestamps if key)
+        names = [f"{num}_month" if num == 1 else f"{num}_months" for num in months]
+
+        return cls(Timestamps[0], [Timestamps[num] for num in months], names)
+
+    @classmethod
+    def from_durations(cls, current_timestamp, durations):
+        """
+        Build periods from their lengths, e.g. {"2_weeks": 2 * MILLI_PER_WEEK, "4_weeks": 4 * MILLI_PER_WEEK}.
+
+        @params
+            - current_timestamp: unix timestamp, in milliseconds (integer)
+            - durations: dictionary of period names to how far back each period starts, in milliseconds, shortest first 
+        @returns 
+            - windows: TimeWindows with the given periods
+        """
+        return cls(current_timestamp, [current_timestamp - duration for duration in durations.values()], list(durations))
+
+    def get_index(self, timestamp):
+        """
+        Determine the time period that a timestamp falls in.
+
+        @params 
+            - timestamp: unix timestamp, in milliseconds (integer)
+        @returns
+            - index: index into names, or -1 if the timestamp is not within a time period (or is on a boundary)
+        """
+        position = bisect_left(self.ascending, timestamp)
+
+        if position == 0 or position == len(self.ascending) or self.ascending[position] == timestamp:
+            return -1
+
+        return len(self.names) - position
+
+    def get_indexes(self, timestamps):
+        """
+        Determine the time period of every timestamp in a list.
+
+        @params 
+            - timestamps: iterable of unix timestamps, in milliseconds (integers)
+        @returns
+            - indexes: list of indexes into names, -1 for timestamps not within a time period
+        """
+        get_index = self.get_index
+
+        return [get_index(timestamp) for timestamp in timestamps]
+
+    def get_pair_index(self, timestamp_1, timestamp_2):
+        """
+        Determine if two timestamps are in the same time period (same as get_similar_timeperiod).
+
+        The first timestamp must be within the period and the second between the start of the period and the current time. 
+
+        @params 
+            - timestamp_1: first time stamp, unix timestamp, in milliseconds (integer)
+            - timestamp_2: second time stamp, unix timestamp, in milliseconds (integer)
+        @returns
+            - index: index into names, or -1 if the timestamps are not within the same time period 
+        """
+        index = self.get_index(timestamp_1)
+
+        if index < 0 or not (self.boundaries[index + 1] < timestamp_2 < self.boundaries[0]):
+            return -1
+
+        return index
+
+    def get_pair_indexes(self, timestamps):
+        """
+        Determine the time period of each consecutive pair of timestamps in a list.
+
+        @params 
+            - timestamps: list of unix timestamps, in milliseconds (integers)
+        @returns
+            - indexes: list with one index per pair (one shorter than timestamps), -1 for pairs not within the same time period
+        """
+        get_pair_index = self.get_pair_index
+
+        return [get_pair_index(timestamps[i], timestamps[i + 1]) for i in range(len(timestamps) - 1)]
+
+    def get_name(self, timestamp):
+        """
+        Determine the name of the time period that a timestamp falls in.
+
+        @params 
+            - timestamp: unix timestamp, in milliseconds (integer)
+        @returns
+            - time_period: name of the time period or None
+        """
+        index = self.get_index(timestamp)
+
+        return self.names[index] if index >= 0 else None
+
+
 def get_time_since_last_batch(current_timestamp, sorted_stock):   
     """
     Get the time since last batch for each part.
@@ -151,12 +301,7 @@ def get_time_since_last_batch(current_timestamp, sorted_stock):
         last_batch = stock_history[stock_index]["stock/timestamp"]
         time_since_last_batch = get_difference(last_batch, current_timestamp)
         sorted_stock[part]["days_since_last_batch"] = time_since_last_batch
-        date = datetime.fromtimestamp(last_batch / 1000) #convert timestamp to seconds from milliseconds 
-        date = datetime.date(date)
-        format_string = '%Y-%m-%d'
-        # Convert the datetime object to a string in the specified format
-        date_string = date.strftime(format_string)
-        sorted_stock[part]["date_last_batch"] = date_string       
+        sorted_stock[part]["date_last_batch"] = get_date_string(last_batch)
 
     return sorted_stock
 
@@ -186,12 +331,7 @@ def get_date_of_last_restock(current_timestamp, parts):
             parts[part_entry]["date_last_restock"] = None
         else:
             last_restock = parts[part_entry]["part/stock"][stock_entry]["stock/timestamp"]
-            date = datetime.fromtimestamp(last_restock/1000) #convert timestamp to seconds from milliseconds first
-            date = datetime.date(date)
-            format_string = '%Y-%m-%d'
-            # Convert the datetime object to a string in the specified format
-            date_string = date.strftime(format_string)
-            parts[part_entry]["date_last_restock"] = date_string         
+            parts[part_entry]["date_last_restock"] = get_date_string(last_restock)
 
         part_entry += 1
 